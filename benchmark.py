@@ -0,0 +1,256 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+import chat_storybook as storybook
+
+# Vocabulary of the synthetic chats: plain words, a few milestone phrases and
+# emoji so that both the ASCII and the Unicode code paths get exercised
+WORDS = ('hey hi hello sorry love you miss i like call me happy birthday what going on good night '
+         'sleep food eat yes no lol okay really today tomorrow home work late coffee movie').split()
+EMOJI = ['😂', '❤️', '😘', '🥰', '😭', '🙈', '✨', '👍🏽', '🤦‍♀️', '💕']
+UNICODE_WORDS = ['café', 'naïve', 'jalebi', 'ठीक', 'है', 'acha', 'señor']
+SKIPPED = ['‎<Media omitted>', 'This message was deleted', '‎image omitted']
+
+DIALECTS = ('ios12', 'ios24', 'android')
+
+# Stages in pipeline order; each gets the outputs of the ones before it.
+# cached_parse loads what parse would return from the parsed message cache.
+STAGES = ('parse', 'cached_parse', 'conversations', 'analytics', 'milestones', 'html')
+
+def sender_names(senders):
+    names = list(storybook.PARTICIPANTS)[:senders]
+    return names + [f"Friend {n}" for n in range(len(names) + 1, senders + 1)]
+
+def format_header(dialect, ts, sender):
+    t = time.gmtime(ts)
+    if dialect == 'ios12':
+        # Newer iOS exports put a narrow no-break space before the meridiem
+        hour = t.tm_hour % 12 or 12
+        meridiem = 'AM' if t.tm_hour < 12 else 'PM'
+        return (f"[{t.tm_mday:02d}/{t.tm_mon:02d}/{t.tm_year % 100:02d}, "
+                f"{hour}:{t.tm_min:02d}:{t.tm_sec:02d} {meridiem}] {sender}: ")
+    if dialect == 'ios24':
+        return (f"[{t.tm_mday:02d}/{t.tm_mon:02d}/{t.tm_year % 100:02d}, "
+                f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}] {sender}: ")
+    return f"{t.tm_mday:02d}/{t.tm_mon:02d}/{t.tm_year}, {t.tm_hour:02d}:{t.tm_min:02d} - {sender}: "
+
+def generate_export(path, lines, dialect='ios12', senders=2, emoji=0.2, multiline=0.05, seed=0):
+    """Write a deterministic synthetic export of about `lines` lines
+
+    The same arguments always produce the same bytes. emoji is the share of
+    messages with emoji or non-ASCII words, multiline the share that run on
+    over extra lines.
+    """
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unknown dialect {dialect!r}, expected one of {DIALECTS}")
+
+    rng = random.Random(seed)
+    names = sender_names(senders)
+    gaps = [5, 20, 60, 300, 1800, 9000, 40000]
+    ts = 1577836800
+    written = 0
+
+    with open(path, 'w', encoding='utf-8') as file:
+        batch = [format_header(dialect, ts, names[0]) + "‎Messages and calls are end-to-end encrypted.\n"]
+        written += 1
+
+        while written < lines:
+            ts += rng.choice(gaps)
+            roll = rng.random()
+            if roll < 0.02:
+                message = rng.choice(SKIPPED)
+            else:
+                message = ' '.join(rng.choices(WORDS, k=rng.randint(1, 12)))
+                if roll < 0.02 + emoji:
+                    message += ' ' + rng.choice(UNICODE_WORDS) + ' ' + ''.join(rng.choices(EMOJI, k=rng.randint(1, 3)))
+
+            batch.append(format_header(dialect, ts, rng.choice(names)) + message + '\n')
+            written += 1
+            while written < lines and rng.random() < multiline:
+                batch.append(' '.join(rng.choices(WORDS, k=rng.randint(1, 6))) + '\n')
+                written += 1
+
+            if len(batch) >= 10000:
+                file.write(''.join(batch))
+                batch = []
+
+        file.write(''.join(batch))
+
+def export_path(data_dir, case):
+    name = f"{case['dialect']}-{case['lines']}-{case['senders']}s-seed{case['seed']}.txt"
+    return os.path.join(data_dir, name)
+
+def run_stage(stage, path, state):
+    if stage == 'parse':
+        state['messages'] = storybook.parse_whatsapp_chat(path, participants=None)
+    elif stage == 'cached_parse':
+        state['cached_messages'] = storybook.parse_whatsapp_chat(path, participants=None, cache_path=f"{path}.cache")
+    elif stage == 'conversations':
+        state['conversations'] = storybook.extract_conversations(state['messages'], min_length=4, max_length=12)
+    elif stage == 'analytics':
+        state['analytics'] = storybook.analyze_chat_data(state['messages'], participants=None)
+    elif stage == 'milestones':
+        state['milestones'] = storybook.find_relationship_milestones(state['messages'])
+    elif stage == 'html':
+        # Streamed to a file like the CLI does; into a string, peak_mb would only measure the page size
+        with open(os.devnull, 'w', encoding='utf-8') as file:
+            storybook.write_clean_html(file, state['messages'], state['analytics'], state['conversations'])
+
+def measure_case(path, lines, memory=True, repeat=1):
+    """Time every stage on one export, and trace its peak memory if asked
+
+    Timings are the best of `repeat` runs without tracing; peak memory comes
+    from a separate tracemalloc run, since tracing slows everything down.
+    """
+    size = os.path.getsize(path)
+    results = {}
+    state = {}
+
+    for stage in STAGES:
+        if stage == 'cached_parse':
+            # Time loading the cache, not writing it
+            with redirect_stdout(io.StringIO()):
+                run_stage(stage, path, state)
+
+        best = None
+        for _ in range(repeat):
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                run_stage(stage, path, state)
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        results[stage] = {
+            'seconds': round(best, 4),
+            'lines_per_second': round(lines / best) if best else None,
+            'mb_per_second': round(size / best / 1e6, 2) if best else None,
+        }
+
+        if memory:
+            tracemalloc.start()
+            with redirect_stdout(io.StringIO()):
+                run_stage(stage, path, state)
+            results[stage]['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+            tracemalloc.stop()
+
+    results['message_count'] = len(state['messages'])
+    results['conversation_count'] = len(state['conversations'])
+    results['bytes'] = size
+    return results
+
+def case_key(case):
+    return f"{case['dialect']}/{case['lines']}/{case['senders']}"
+
+def compare_to_baseline(report, baseline, tolerance, min_seconds=0.05):
+    """List the stages that got slower, or hungrier, than the baseline allows
+
+    Slowdowns under min_seconds are ignored as timer noise. Runs generated
+    with other emoji, multiline or seed settings are different workloads,
+    so comparing against one raises ValueError.
+    """
+    if baseline.get('settings') != report['settings']:
+        raise ValueError(f"baseline settings {baseline.get('settings')} differ from {report['settings']}")
+
+    regressions = []
+    for key, stages in report['cases'].items():
+        previous = baseline['cases'].get(key)
+        if previous is None:
+            continue
+        for stage in STAGES:
+            now, before = stages[stage], previous.get(stage)
+            if before is None:
+                continue
+            if (now['seconds'] > before['seconds'] * (1 + tolerance) and
+                now['seconds'] - before['seconds'] > min_seconds):
+                regressions.append(f"{key} {stage}: {before['seconds']}s -> {now['seconds']}s")
+            if 'peak_mb' in now and 'peak_mb' in before and now['peak_mb'] > before['peak_mb'] * (1 + tolerance):
+                regressions.append(f"{key} {stage}: {before['peak_mb']} MB -> {now['peak_mb']} MB peak")
+    return regressions
+
+def print_case(key, results):
+    print(f"\n📊 {key}: {results['message_count']} messages, {results['conversation_count']} conversations, "
+          f"{results['bytes'] / 1e6:.1f} MB")
+    for stage in STAGES:
+        stats = results[stage]
+        memory = f"{stats['peak_mb']:>9.1f} MB peak" if 'peak_mb' in stats else ''
+        print(f"   {stage:<14}{stats['seconds']:>9.3f}s {stats['lines_per_second'] or 0:>12,} lines/s"
+              f"{stats['mb_per_second'] or 0:>9.1f} MB/s{memory}")
+
+def parse_sizes(text):
+    sizes = []
+    for size in text.split(','):
+        size = size.strip().lower()
+        scale = {'k': 1000, 'm': 1000000}.get(size[-1:], 1)
+        sizes.append(int(float(size.rstrip('km')) * scale))
+    return sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of chat_storybook on synthetic exports")
+    parser.add_argument('--lines', default='10k,100k', help="comma separated export sizes, e.g. 10k,1m,50m")
+    parser.add_argument('--dialects', default='ios12,android', help=f"comma separated, from {', '.join(DIALECTS)}")
+    parser.add_argument('--senders', type=int, default=2, help="participants per chat")
+    parser.add_argument('--emoji', type=float, default=0.2, help="share of messages with emoji and non-ASCII words")
+    parser.add_argument('--multiline', type=float, default=0.05, help="share of messages that span several lines")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage, the best one counts")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc runs")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'chat_storybook_bench'),
+                        help="where generated exports are cached")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="compare against results saved with --output")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument('--min-seconds', type=float, default=0.05, help="slowdowns below this are noise")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        'python': sys.version.split()[0],
+        'numpy': storybook.np is not None,
+        'settings': {'emoji': args.emoji, 'multiline': args.multiline, 'seed': args.seed},
+        'cases': {},
+    }
+
+    for dialect in args.dialects.split(','):
+        for lines in parse_sizes(args.lines):
+            case = {'dialect': dialect.strip(), 'lines': lines, 'senders': args.senders, 'seed': args.seed}
+            path = export_path(args.data_dir, case)
+            if not os.path.exists(path):
+                print(f"🧪 Generating {path}...")
+                generate_export(path, lines, case['dialect'], args.senders, args.emoji, args.multiline, args.seed)
+
+            key = case_key(case)
+            report['cases'][key] = measure_case(path, lines, memory=not args.no_memory, repeat=args.repeat)
+            print_case(key, report['cases'][key])
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"\n💾 Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        try:
+            regressions = compare_to_baseline(report, baseline, args.tolerance, args.min_seconds)
+        except ValueError as e:
+            print(f"\n❌ Cannot compare against {args.baseline}: {e}")
+            return 1
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            return 1
+        print(f"\n✅ No regressions against {args.baseline}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
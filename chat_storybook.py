@@ -1,208 +1,2047 @@
 import re
+import os
+import gzip
+import glob
+import codecs
 import json
+import base64
+import hashlib
+import html
+import io
 import random
+import sys
+import zlib
+import argparse
+import cProfile
+import tracemalloc
+import zipfile
+from mmap import mmap, ACCESS_READ
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stdout
 from datetime import datetime, timedelta
+from itertools import accumulate, islice, repeat
+from operator import contains, itemgetter, le
+from time import perf_counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Invisible characters WhatsApp sprinkles through exports and their replacements
+INVISIBLE_CHARACTERS = (
+    ('\u202f', ' '),
+    ('\u200e', ''),
+    ('\u200d', ''),
+    ('\u200c', ''),
+    ('\ufeff', ''),
+)
+
+# Timestamp prefixes of the different export flavours. Each one captures the
+# date, the time and (on 12h exports) the AM/PM marker, in that order.
+CHAT_DIALECTS = {
+    # [08/09/20, 1:32:37 PM] Name: message
+    'ios': r'\[(\d{1,2}/\d{1,2}/\d{2,4}),[ \t]*(\d{1,2}:\d{2}(?::\d{2})?)[ \t\u202f]*([AaPp]\.?[ \t\u202f]?[Mm]\.?)?\]',
+    # 08/09/2020, 13:32 - Name: message
+    'android': r'(\d{1,2}/\d{1,2}/\d{2,4}),?[ \t]+(\d{1,2}:\d{2}(?::\d{2})?)[ \t\u202f]*([AaPp]\.?[ \t\u202f]?[Mm]\.?)?[ \t\u202f]+-',
+}
+
+SKIPPED_MESSAGE_PREFIXES = (
+    'Messages and calls are end-to-end encrypted',
+    'You deleted',
+    '<Media omitted>',
+    'This message was deleted',
+)
+
+# Senders whose messages are kept; the first is "you" in the viewer and the
+# legacy analytics. Pass participants=None to keep everyone who writes.
+PARTICIPANTS = ('Aaditya', 'Shloka')
+
+# Characters read per chunk while streaming an export
+CHUNK_SIZE = 1 << 20
+
+def strip_invisible(text):
+    """Remove invisible Unicode characters without trimming whitespace"""
+    # Pure ASCII text cannot contain any of them, and isascii() is O(1)
+    if not text.isascii():
+        for char, replacement in INVISIBLE_CHARACTERS:
+            text = text.replace(char, replacement)
+    return text
 
 def clean_unicode(text):
     """Remove invisible Unicode characters"""
-    text = text.replace('\u202f', ' ')
-    text = text.replace('\u200e', '')
-    text = text.replace('\u200d', '')
-    text = text.replace('\u200c', '')
-    return text.strip()
+    return strip_invisible(text).strip()
+
+# A line that begins with a full timestamp header of the dialect starts a new
+# entry, every other line continues the message above it, even one that
+# happens to start with a date. Notices without a sender still start their
+# own entry. ENTRY_CANDIDATE is a cheap, looser test that finds the lines
+# worth checking in raw text, direction marks included.
+ENTRY_CANDIDATE = r'[ \t\u200e\ufeff]*\[?\d{1,2}/\d{1,2}/'
+_entry_candidate = re.compile(r'\n' + ENTRY_CANDIDATE)
 
-def parse_whatsapp_chat(file_path):
-    """Parse WhatsApp chat with Unicode handling"""
-    messages = []
-    pattern = r'\[(\d{1,2}/\d{1,2}/\d{2,4}),\s*(\d{1,2}:\d{2}:\d{2}).*?\]\s*([^:]+):\s*(.+)'
+def _non_capturing(pattern):
+    return re.sub(r'(?<!\\)\((?!\?)', '(?:', pattern)
+
+_dialect_patterns = {}
+_entry_start_patterns = {}
+
+# Blanks and invisible characters that may come before an entry's header
+_LINE_START = '[ \t' + ''.join(char for char, _ in INVISIBLE_CHARACTERS) + ']*'
+
+def compile_dialect(dialect):
+    """Compile the message tokenizer for a dialect, once per process
     
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
+    The tokenizer runs over whole chunks of text where every line is preceded
+    by a newline, so findall tokenizes a chunk in a single C-level pass,
+    continuation lines included. It matches the raw text: the marks exports
+    put at the start of a line and the narrow spaces before AM/PM are
+    allowed for, so invisible characters only need stripping per message.
+    """
+    pattern = _dialect_patterns.get(dialect)
+    if pattern is None:
+        pattern = _dialect_patterns[dialect] = re.compile(
+            r'\n' + _LINE_START + CHAT_DIALECTS[dialect] +
+            r'[ \t]*([^:\n]+):([^\n]*(?:\n(?!' + _LINE_START + _non_capturing(CHAT_DIALECTS[dialect]) +
+            r')[^\n]*)*)'
+        )
+    return pattern
+
+def compile_entry_start(dialect):
+    """Compile the test for a line, stripped of invisible characters, that starts an entry"""
+    pattern = _entry_start_patterns.get(dialect)
+    if pattern is None:
+        pattern = _entry_start_patterns[dialect] = re.compile(r'[ \t]*' + _non_capturing(CHAT_DIALECTS[dialect]))
+    return pattern
+
+def _starts_entry(text, position, dialect):
+    """Whether the line after the newline at position starts an entry"""
+    end = text.find('\n', position + 1)
+    line = text[position + 1:end if end >= 0 else len(text)]
+    return compile_entry_start(dialect).match(strip_invisible(line)) is not None
+
+def detect_dialect(text):
+    """Return the dialect with the most message headers in a sample of the export"""
+    text = '\n' + strip_invisible(text)
+    counts = {name: len(compile_dialect(name).findall(text)) for name in CHAT_DIALECTS}
+    best = max(counts, key=counts.get)
+    return best if counts[best] else None
+
+def _last_entry_start(text, dialect):
+    """Find where the last message that may still continue in the next chunk begins"""
+    position = text.rfind('\n')
+    while position > 0:
+        # The line after the last newline is incomplete, so only earlier lines count
+        position = text.rfind('\n', 0, position)
+        if position >= 0 and _entry_candidate.match(text, position) and _starts_entry(text, position, dialect):
+            return position
+    return 0
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Messages further apart than this start a new conversation thread
+CONVERSATION_GAP = 2 * 60 * 60
+
+# How messages show their date, by the export's day/month order
+DATE_FORMATS = {'dmy': '%d/%m/%y', 'mdy': '%m/%d/%y'}
+
+def detect_date_order(dates):
+    """Tell day-first from month-first dates by looking for a field above 12
+    
+    Returns None while no date settles it.
+    """
+    month_first = False
+    for date in dates:
+        first, second, _ = date.split('/', 2)
+        if int(first) > 12:
+            return 'dmy'
+        if int(second) > 12:
+            month_first = True
+    return 'mdy' if month_first else None
+
+class TimestampParser:
+    """Turn an export's date and time tokens into epoch seconds
+    
+    Exports repeat the same dates and clock readings over and over, so both
+    halves are parsed once and memoized; a timestamp is then two dict
+    lookups and an addition. A clock reading is memoized together with the
+    time of day as messages show it, AM/PM normalized.
+    """
+    
+    def __init__(self, date_order='dmy'):
+        self.date_order = date_order
+        self.dates = {}
+        self.clocks = {}
+    
+    def day_start(self, date):
+        """Epoch seconds at midnight of a date, or None if it is not a real date"""
+        if self.date_order == 'dmy':
+            day, month, year = date.split('/')
+        else:
+            month, day, year = date.split('/')
+        year = int(year)
+        if year < 100:
+            year += 2000
+        
+        try:
+            moment = datetime(year, int(month), int(day))
+        except ValueError:
+            return None
+        return (moment - _EPOCH).days * 86400
+    
+    def seconds_of_day(self, clock, ampm=''):
+        """Seconds since midnight of an H:MM[:SS] reading with optional AM/PM"""
+        hour, minute, *second = clock.split(':')
+        hour = int(hour)
+        if ampm:
+            hour = hour % 12 + (12 if ampm[0] in 'Pp' else 0)
+        return hour * 3600 + int(minute) * 60 + (int(second[0]) if second else 0)
+    
+    def clock(self, clock, ampm=''):
+        """(seconds since midnight, time as shown) of a raw clock reading"""
+        if ampm:
+            ampm = clean_unicode(ampm)
+            return self.seconds_of_day(clock, ampm), f"{clock} {ampm.replace('.', '').replace(' ', '').upper()}"
+        return self.seconds_of_day(clock), clock
+    
+    def __call__(self, date, clock, ampm=''):
+        try:
+            day = self.dates[date]
+        except KeyError:
+            day = self.dates[date] = self.day_start(date)
+        if day is None:
+            return None
         
-        print(f"📁 File loaded: {len(lines)} lines")
+        try:
+            return day + self.clocks[clock, ampm][0]
+        except KeyError:
+            reading = self.clocks[clock, ampm] = self.clock(clock, ampm)
+            return day + reading[0]
+
+# Leading bytes of the compressed containers an export may come in
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+
+def chat_source_kind(source):
+    """'stream' for a file object, else 'zip', 'gzip' or 'file' by the path's leading bytes"""
+    if hasattr(source, 'read'):
+        return 'stream'
+    with open(source, 'rb') as file:
+        head = file.read(4)
+    if head.startswith(ZIP_MAGIC):
+        return 'zip'
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    return 'file'
+
+def chat_archive_member(archive):
+    """Name of the chat inside an exported zip: _chat.txt on iOS, 'WhatsApp Chat with ….txt' on Android"""
+    names = [name for name in archive.namelist() if name.endswith('.txt') and not name.endswith('/')]
+    for name in names:
+        if os.path.basename(name) == '_chat.txt':
+            return name
+    for name in names:
+        if os.path.basename(name).startswith('WhatsApp Chat'):
+            return name
+    if names:
+        return names[0]
+    raise ValueError(f"No chat .txt found in {archive.filename}")
+
+@contextmanager
+def open_chat_source(source):
+    """Open an export for binary streaming reads
+    
+    source is a path to a plain export, to a gzip of one or to a zip archive
+    as WhatsApp shares them, or an already open binary file object. Archives
+    are decompressed on the fly and never extracted to disk. File objects
+    are left open for the caller.
+    """
+    kind = chat_source_kind(source)
+    if kind == 'stream':
+        yield source
+    elif kind == 'zip':
+        with zipfile.ZipFile(source) as archive, archive.open(chat_archive_member(archive)) as file:
+            yield file
+    elif kind == 'gzip':
+        with gzip.open(source, 'rb') as file:
+            yield file
+    else:
+        with open(source, 'rb') as file:
+            yield file
+
+class PipelineMetrics:
+    """Stage timings and counters of one pipeline run
+    
+    Functions that take a metrics argument only record into it when one is
+    passed, so the hot paths pay nothing by default. The parser counts
+    lines read, entries matched and messages dropped per filter rule under
+    'filtered.*', with a few examples of timestamps that failed to parse.
+    """
+    
+    def __init__(self):
+        self.stages = {}
+        self.counters = Counter()
+        self.samples = {}
+    
+    @contextmanager
+    def stage(self, name):
+        """Time a block; repeated blocks of the same stage add up"""
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            timing = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            timing['seconds'] += perf_counter() - start
+            timing['calls'] += 1
+    
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+    
+    def sample(self, name, value, limit=5):
+        values = self.samples.setdefault(name, [])
+        if len(values) < limit:
+            values.append(value)
+    
+    def merge(self, other):
+        """Add another run's counters and timings, e.g. a parser shard's"""
+        self.counters.update(other.counters)
+        for name, timing in other.stages.items():
+            mine = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            mine['seconds'] += timing['seconds']
+            mine['calls'] += timing['calls']
+        for name, values in other.samples.items():
+            for value in values:
+                self.sample(name, value)
+        return self
+    
+    def report(self):
+        """Everything recorded, as plain data for json.dump"""
+        return {
+            'stages': {name: {'seconds': round(timing['seconds'], 6), 'calls': timing['calls']}
+                       for name, timing in self.stages.items()},
+            'counters': dict(sorted(self.counters.items())),
+            'samples': self.samples
+        }
+    
+    def summary(self):
+        """One line per stage and counter for the console"""
+        lines = [f"   {name:<16}{timing['seconds']:>10.3f}s" for name, timing in self.stages.items()]
+        lines += [f"   {name:<28}{value:>12,}" for name, value in sorted(self.counters.items())]
+        return '\n'.join(lines)
+
+class ChatReader:
+    """Stream messages out of an export and remember how far it got
+    
+    Iterating yields message dicts like iter_whatsapp_messages. The file is
+    read as bytes so that afterwards `offset` is the byte position of the
+    first entry not yet tokenized; a later reader can start from there.
+    With hold_last the final entry of the file is not tokenized at all, since
+    it is the only one an appended line could still extend. It stays in
+    `held` and read_held() parses it. Reading stops at byte `end` if given,
+    which like `start` must be the beginning of an entry. Only messages from
+    participants are kept, or from anyone if that is None. Parse counters go
+    to metrics if given, see PipelineMetrics.
+    
+    Unless date_order is given, nothing is tokenized until a date with a
+    field above 12 settles whether days or months come first; the text read
+    until then is held. An export with no such date at all is read day
+    first, and date_order stays None to tell that it was only a guess.
+    
+    file_path may also be a zip or gzip export or a binary file object, see
+    open_chat_source. Those can only be read from start to end: start and
+    end need a plain file.
+    """
+    
+    def __init__(self, file_path, dialect=None, date_order=None, start=0, hold_last=False, end=None,
+                 participants=PARTICIPANTS, metrics=None):
+        if (start or end is not None) and chat_source_kind(file_path) != 'file':
+            raise ValueError("Reading part of an export needs a plain file, not an archive or stream")
+        self.file_path = file_path
+        self.dialect = dialect
+        self.date_order = date_order
+        self.offset = start
+        self.end = end
+        self.hold_last = hold_last
+        self.held = ''
+        self.senders = None if participants is None else frozenset(participants)
+        self.metrics = metrics
+        self._tokenizer = compile_dialect(dialect) if dialect else None
+        self._timestamp = TimestampParser(date_order) if date_order else None
+        # Cleaned up sender names by their raw text
+        self._names = {}
+    
+    def __iter__(self):
+        for records in self.batches():
+            for date, time, sender, message, ts in records:
+                yield {
+                    'date': date,
+                    'time': time,
+                    'sender': sender,
+                    'message': message,
+                    'ts': ts
+                }
+    
+    def batches(self):
+        """Like iterating, but yield each chunk's messages as one list of (date, time, sender, message, ts)"""
+        start = self.offset
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        # Text always starts at the newline before an entry. At the start of
+        # the file that newline is made up, which the -1 accounts for.
+        consumed = start - 1
+        tail = '' if start else '\n'
+        undecided = []
         
-        for line in lines:
-            line = clean_unicode(line.strip())
-            if not line:
-                continue
+        with open_chat_source(self.file_path) as file:
+            if start:
+                file.seek(start - 1)
             
-            match = re.match(pattern, line)
-            if match:
-                date = match.group(1)
-                time = match.group(2)
-                sender = clean_unicode(match.group(3))
-                message = clean_unicode(match.group(4))
+            while True:
+                size = CHUNK_SIZE if self.end is None else min(CHUNK_SIZE, self.end - file.tell())
+                chunk = file.read(size) if size > 0 else b''
+                text = tail + decoder.decode(chunk, final=not chunk)
                 
-                if (message and 
-                    not message.startswith('Messages and calls are end-to-end encrypted') and
-                    not message.startswith('You deleted') and
-                    not message.startswith('<Media omitted>') and
-                    not message.startswith('This message was deleted') and
-                    sender in ['Aaditya', 'Shloka']):
-                    
-                    messages.append({
-                        'date': date,
-                        'time': time,
-                        'sender': sender,
-                        'message': message
-                    })
+                if self._tokenizer is None:
+                    self.dialect = detect_dialect(text)
+                    if self.dialect is None:
+                        if not chunk:
+                            break
+                        cut = text.rfind('\n')
+                        consumed += len(text[:cut].encode('utf-8'))
+                        if self.metrics is not None:
+                            self.metrics.count('lines_read', text.count('\n', 0, cut))
+                        tail = text[cut:]
+                        continue
+                    self._tokenizer = compile_dialect(self.dialect)
+                
+                # Only tokenize up to the last entry, the rest waits for the next chunk
+                if chunk or self.hold_last:
+                    cut = _last_entry_start(text, self.dialect)
+                    text, tail = text[:cut], text[cut:]
+                
+                if self._timestamp is None:
+                    undecided.append(text)
+                    dates = (token[0] for token in self._tokenizer.findall(strip_invisible(text)))
+                    self.date_order = detect_date_order(dates)
+                    if self.date_order is None and chunk:
+                        continue
+                    self._timestamp = TimestampParser(self.date_order or 'dmy')
+                    text = ''.join(undecided)
+                    undecided = None
+                
+                yield self._records(text)
+                consumed += len(text.encode('utf-8'))
+                self.offset = consumed + 1
+                
+                if not chunk:
+                    if self.metrics is not None and not self.hold_last and text.endswith('\n'):
+                        # The file's final newline ends a line rather than starting one
+                        self.metrics.count('lines_read', -1)
+                    self.held = tail if self.hold_last else ''
+                    break
+    
+    def read_held(self):
+        """Parse the entry held back by hold_last"""
+        if self._tokenizer is None:
+            return []
+        messages = [
+            {'date': date, 'time': time, 'sender': sender, 'message': message, 'ts': ts}
+            for date, time, sender, message, ts in self._records(self.held)
+        ]
+        if self.metrics is not None and self.held.endswith('\n'):
+            self.metrics.count('lines_read', -1)
+        return messages
+    
+    def _records(self, text):
+        senders = self.senders
+        timestamp = self._timestamp
+        days = timestamp.dates
+        clocks = timestamp.clocks
+        names = self._names
+        metrics = self.metrics
+        entries = self._tokenizer.findall(text)
+        records = []
+        append = records.append
+        empty = skipped = others = invalid = 0
+        
+        for date, time, ampm, sender, message in entries:
+            message = message.strip()
+            if not message.isascii():
+                message = strip_invisible(message).strip()
+            if not message:
+                empty += 1
+                continue
+            if message.startswith(SKIPPED_MESSAGE_PREFIXES):
+                skipped += 1
+                continue
+            
+            name = names.get(sender)
+            if name is None:
+                name = names[sender] = clean_unicode(sender)
+            if senders is not None and name not in senders:
+                others += 1
+                continue
+            
+            # TimestampParser's lookups, inlined
+            day = days.get(date)
+            if day is None:
+                day = days[date] = timestamp.day_start(date)
+                if day is None:
+                    invalid += 1
+                    if metrics is not None:
+                        metrics.sample('invalid_timestamps', f"{date}, {time} {clean_unicode(ampm)}".rstrip())
+                    continue
+            clock = clocks.get((time, ampm))
+            if clock is None:
+                clock = clocks[time, ampm] = timestamp.clock(time, ampm)
+            
+            append((date, clock[1], name, message, day + clock[0]))
+        
+        if metrics is not None:
+            metrics.count('lines_read', text.count('\n'))
+            metrics.count('entries_matched', len(entries))
+            metrics.count('filtered.empty', empty)
+            metrics.count('filtered.skipped_prefix', skipped)
+            metrics.count('filtered.other_sender', others)
+            metrics.count('filtered.invalid_timestamp', invalid)
+            metrics.count('messages_kept', len(records))
+        return records
+
+def iter_whatsapp_messages(file_path, dialect=None, date_order=None, participants=PARTICIPANTS, metrics=None):
+    """Yield parsed messages one at a time without loading the whole file
+    
+    The file is read in CHUNK_SIZE pieces, so memory use stays flat however
+    large the export is. Multi-line messages are kept whole: a chunk is only
+    tokenized up to its last header, the remainder is carried into the next
+    one. The dialect is detected from the first chunk unless given. The
+    day/month order is settled by the first date with a field above 12,
+    which may take more than one chunk, see ChatReader. Every message
+    carries its epoch timestamp as 'ts'. Entries whose date does not exist
+    are skipped, and so are senders other than participants unless that is
+    None. Zip and gzip exports and binary file objects are read in place,
+    see open_chat_source.
+    """
+    return iter(ChatReader(file_path, dialect, date_order, participants=participants, metrics=metrics))
+
+class MessageRow:
+    """Read-only view of one stored message that behaves like the old message dict"""
+    __slots__ = ('store', 'index')
+    
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+    
+    def __getitem__(self, key):
+        store = self.store
+        if key == 'message':
+            return store.message_text(self.index)
+        if key == 'sender':
+            return store.senders[store.sender_ids[self.index]]
+        if key == 'ts':
+            return store.timestamps[self.index]
+        if key == 'date':
+            return (_EPOCH + timedelta(seconds=store.timestamps[self.index])).strftime(DATE_FORMATS[store.date_order])
+        if key == 'time':
+            return (_EPOCH + timedelta(seconds=store.timestamps[self.index])).strftime('%H:%M:%S')
+        raise KeyError(key)
+    
+    def keys(self):
+        return ('date', 'time', 'sender', 'message')
+    
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+class MessageStore:
+    """Columnar message storage: a few bytes of overhead per message instead of a dict
+    
+    Timestamps are epoch seconds in an array, senders are interned to small
+    ints and all message text lives UTF-8 encoded in one buffer, sliced by
+    offsets. Iterating or indexing yields MessageRow views. A store loaded
+    by load_message_cache has memoryviews for columns and is read-only.
+    date_order is the export's day/month order, which the rows show their
+    dates in.
+    """
+    
+    def __init__(self, date_order='dmy'):
+        self.timestamps = array('q')
+        self.sender_ids = array('H')
+        self.offsets = array('q', [0])
+        self.text = bytearray()
+        self.senders = []
+        self.sender_index = {}
+        self.date_order = date_order
+    
+    @classmethod
+    def from_messages(cls, messages):
+        store = cls()
+        if isinstance(messages, ChatReader):
+            # Straight from the reader's records, without a dict per message
+            for records in messages.batches():
+                store.add_columns(map(itemgetter(4), records), list(map(itemgetter(2), records)),
+                                  map(itemgetter(3), records))
+            store.date_order = messages.date_order or 'dmy'
+            return store
         
+        messages = iter(messages)
+        while batch := list(islice(messages, 4096)):
+            store.add_columns(map(itemgetter('ts'), batch), list(map(itemgetter('sender'), batch)),
+                              map(itemgetter('message'), batch))
+        return store
+    
+    def append(self, msg):
+        self.add(msg['ts'], msg['sender'], msg['message'])
+    
+    def add(self, timestamp, sender, message):
+        sender_id = self.sender_index.get(sender)
+        if sender_id is None:
+            sender_id = self.sender_index[sender] = len(self.senders)
+            self.senders.append(sender)
+        
+        self.timestamps.append(timestamp)
+        self.sender_ids.append(sender_id)
+        self.text += message.encode('utf-8')
+        self.offsets.append(len(self.text))
+    
+    def add_columns(self, timestamps, senders, messages):
+        """Append many messages at once, given column by column
+        
+        The timestamps and messages may be any iterables, the senders are
+        gone through twice and have to be a sequence.
+        """
+        for sender in dict.fromkeys(senders):
+            if sender not in self.sender_index:
+                self.sender_index[sender] = len(self.senders)
+                self.senders.append(sender)
+        
+        encoded = list(map(str.encode, messages))
+        self.timestamps.extend(timestamps)
+        self.sender_ids.extend(map(self.sender_index.__getitem__, senders))
+        self.offsets.extend(islice(accumulate(map(len, encoded), initial=len(self.text)), 1, None))
+        self.text += b''.join(encoded)
+    
+    def extend(self, other):
+        """Append every message of another store, re-interning its senders"""
+        sender_ids = [self.sender_index.get(sender) for sender in other.senders]
+        for old_id, sender in enumerate(other.senders):
+            if sender_ids[old_id] is None:
+                sender_ids[old_id] = self.sender_index[sender] = len(self.senders)
+                self.senders.append(sender)
+        
+        if sender_ids == list(range(len(sender_ids))):
+            self.sender_ids.extend(other.sender_ids)
+        else:
+            self.sender_ids.extend(array('H', [sender_ids[i] for i in other.sender_ids]))
+        
+        base = len(self.text)
+        self.timestamps.extend(other.timestamps)
+        self.offsets.extend(array('q', [offset + base for offset in other.offsets[1:]]))
+        self.text += other.text
+        return self
+    
+    def message_text(self, index):
+        return str(self.text[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+    
+    def __len__(self):
+        return len(self.timestamps)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Like slicing the list the parser used to return
+            return [MessageRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('message index out of range')
+        return MessageRow(self, index)
+    
+    def __iter__(self):
+        for index in range(len(self.timestamps)):
+            yield MessageRow(self, index)
+
+# Parsed message cache. Bump PARSER_VERSION whenever a change to parsing
+# would turn the same export into different messages; incremental snapshots
+# and batch manifests check it too.
+PARSER_VERSION = 2
+MESSAGE_CACHE_MAGIC = b'CHATMSG1'
+
+def message_cache_key(file_path, participants=PARTICIPANTS):
+    """Everything a cached parse of file_path depends on"""
+    stat = os.stat(file_path)
+    return {
+        'parser_version': PARSER_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': _content_hash(file_path, stat.st_size),
+        'participants': None if participants is None else sorted(participants),
+        'byteorder': sys.byteorder
+    }
+
+def write_container(path, magic, header, sections):
+    """Write a JSON header and raw sections to one file, atomically
+    
+    The layout of the message cache and saved search indexes: magic, header
+    size, JSON header, then the sections, each padded to 8 bytes so that
+    map_container can map them in place. The header gets the section sizes
+    added as 'sections'.
+    """
+    sizes = [memoryview(section).nbytes for section in sections]
+    data = json.dumps(dict(header, sections=sizes), ensure_ascii=False).encode('utf-8')
+    data += b' ' * (-(len(magic) + 8 + len(data)) % 8)
+    
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(magic + len(data).to_bytes(8, 'little') + data)
+        for section, size in zip(sections, sizes):
+            file.write(section)
+            file.write(b'\0' * (-size % 8))
+    os.replace(temp_path, path)
+
+def map_container(path, magic):
+    """Map a file written by write_container, returning (header, sections)
+    
+    The sections are memoryviews straight onto the mapped file, so opening
+    takes the same few milliseconds whatever the file's size and pages are
+    only read when touched. Raises ValueError for a file that does not start
+    with magic or is damaged.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap(file.fileno(), 0, access=ACCESS_READ)
+    
+    position = len(magic) + 8
+    if mapped[:len(magic)] != magic:
+        raise ValueError(f"{path} does not start with {magic!r}")
+    header_size = int.from_bytes(mapped[len(magic):position], 'little')
+    header = json.loads(mapped[position:position + header_size])
+    position += header_size
+    
+    data = memoryview(mapped)
+    sections = []
+    try:
+        for size in header['sections']:
+            sections.append(data[position:position + size])
+            position += size + -size % 8
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"{path} has a damaged header") from e
+    if position > len(mapped):
+        raise ValueError(f"{path} is truncated")
+    return header, sections
+
+def _store_sections(messages):
+    """Header fields and sections that save a MessageStore into a container"""
+    header = {'senders': messages.senders, 'date_order': messages.date_order}
+    return header, [messages.timestamps, messages.sender_ids, messages.offsets, messages.text]
+
+def _mapped_store(header, sections):
+    """Read-only MessageStore over sections mapped by map_container"""
+    timestamps, sender_ids, offsets, text = sections
+    messages = MessageStore(header['date_order'])
+    messages.timestamps = timestamps.cast('q')
+    messages.sender_ids = sender_ids.cast('H')
+    messages.offsets = offsets.cast('q')
+    messages.text = text
+    if not (len(messages.sender_ids) == len(messages.timestamps) == len(messages.offsets) - 1 and
+            messages.offsets[-1] == len(text)):
+        raise ValueError("inconsistent message columns")
+    messages.senders = list(header['senders'])
+    messages.sender_index = {sender: i for i, sender in enumerate(messages.senders)}
+    return messages
+
+def save_message_cache(cache_path, messages, key):
+    """Write a MessageStore and its cache key to one container file, see write_container"""
+    header, sections = _store_sections(messages)
+    write_container(cache_path, MESSAGE_CACHE_MAGIC, dict(header, key=key), sections)
+
+def load_message_cache(cache_path, key):
+    """Map a cache written by save_message_cache, or None if it is missing or stale
+    
+    The store's columns are mapped in place, see map_container. A damaged
+    file counts as missing.
+    """
+    try:
+        header, sections = map_container(cache_path, MESSAGE_CACHE_MAGIC)
+        if header.get('key') != key:
+            return None
+        return _mapped_store(header, sections)
+    except (OSError, AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+def parse_whatsapp_chat(file_path, workers=1, participants=PARTICIPANTS, metrics=None, cache_path=None):
+    """Parse WhatsApp chat with Unicode handling into a MessageStore
+    
+    With more than one worker, large files are parsed in parallel shards,
+    see parse_chat_parallel. Archives and streams cannot be split, so they
+    are always parsed serially. Parse counters and the 'parse' stage timing
+    go to metrics if given, and so does a failed parse as 'errors'.
+    
+    With a cache_path the parsed messages are saved there, and as long as
+    the export, the participants and PARSER_VERSION stay the same, later
+    calls map them back in instead of parsing, see load_message_cache.
+    """
+    try:
+        with (metrics or PipelineMetrics()).stage('parse'):
+            key = None
+            if cache_path is not None and chat_source_kind(file_path) != 'stream':
+                key = message_cache_key(file_path, participants)
+                messages = load_message_cache(cache_path, key)
+                if messages is not None:
+                    if metrics is not None:
+                        metrics.count('cache_hits')
+                    print(f"⚡ Loaded {len(messages)} parsed messages from {cache_path}")
+                    return messages
+            
+            if workers == 1 or chat_source_kind(file_path) != 'file':
+                messages = MessageStore.from_messages(
+                    ChatReader(file_path, participants=participants, metrics=metrics))
+            else:
+                messages = parse_chat_parallel(file_path, workers, analyze=False, participants=participants,
+                                               metrics=metrics)[0]
+            if key is not None:
+                # The parse succeeded, a cache that cannot be written only costs the next run
+                try:
+                    save_message_cache(cache_path, messages, key)
+                except OSError as e:
+                    if metrics is not None:
+                        metrics.count('cache_write_errors')
+                        metrics.sample('cache_write_errors', f"{type(e).__name__}: {e}")
+                    print(f"⚠️ Could not write the message cache: {e}")
         print(f"✅ Successfully parsed {len(messages)} messages")
         return messages
         
     except Exception as e:
+        if metrics is not None:
+            metrics.count('errors')
+            metrics.sample('errors', f"{type(e).__name__}: {e}")
         print(f"❌ Error: {e}")
-        return []
-
-def find_relationship_milestones(messages):
-    """Find special moments in your relationship - SIMPLIFIED"""
-    milestones = []
-    
-    # Simplified milestone patterns - removed cute names
-    milestone_patterns = {
-        "First 'I like you'": [
-            r'\bi\s+like\s+you\b',
-            r'\bi\s+really\s+like\s+you\b',
-            r'\byou\s+know\s+i\s+like\s+you\b'
-        ],
-        "First 'I love you'": [
-            r'\bi\s+love\s+you\b',
-            r'\blove\s+you\s+too\b',
-            r'\bi\s+really\s+love\s+you\b'
-        ],
-        "First video/voice call mention": [
-            r'\bcall\s+me\b', r'\bvideo\s+call\b', r'\bvoice\s+call\b',
-            r'\blet\'s\s+call\b', r'\bcalling\s+you\b'
-        ],
-        "First 'miss you'": [
-            r'\bi\s+miss\s+you\b', r'\bmissing\s+you\b', r'\bmiss\s+you\s+so\s+much\b'
-        ],
-        "First birthday wishes": [
-            r'\bhappy\s+birthday\b', r'\bbirthday\s+wishes\b', r'\bspecial\s+day\b'
-        ]
-    }
+        return MessageStore()
+
+# Files smaller than this per worker are not worth splitting
+MIN_SHARD_SIZE = 4 << 20
+
+def sniff_chat_format(file_path):
+    """Detect the dialect and date order of an export
+    
+    The dialect comes from the first chunk. The date order is read from as
+    many chunks as it takes to find a date that settles it, see ChatReader,
+    and is 'dmy' if none does.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    with open(file_path, 'rb') as file:
+        chunk = file.read(CHUNK_SIZE)
+        text = '\n' + strip_invisible(decoder.decode(chunk, final=not chunk))
+        dialect = detect_dialect(text)
+        if dialect is None:
+            return None, None
+        
+        tokenizer = compile_dialect(dialect)
+        while True:
+            # The last line may be incomplete, it is read again with the next chunk
+            cut = text.rfind('\n') if chunk else len(text)
+            date_order = detect_date_order(token[0] for token in tokenizer.findall(text, 0, cut))
+            if date_order is not None or not chunk:
+                return dialect, date_order or 'dmy'
+            chunk = file.read(CHUNK_SIZE)
+            text = text[cut:] + strip_invisible(decoder.decode(chunk, final=not chunk))
+
+def shard_boundaries(file_path, shards, dialect):
+    """Split an export into byte ranges that each start at an entry
+    
+    Every cut is moved forward to the next line that starts an entry, so no
+    message, multi-line ones included, is ever split between shards.
+    """
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    
+    with open(file_path, 'rb') as file:
+        for shard in range(1, shards):
+            position = max(size * shard // shards, boundaries[-1])
+            file.seek(position)
+            window = b''
+            
+            while True:
+                block = file.read(CHUNK_SIZE)
+                if not block:
+                    position = size
+                    break
+                window += block
+                # A newline byte never occurs inside a multi-byte character
+                newline = window.find(b'\n')
+                if newline < 0:
+                    continue
+                text = window[newline:].decode('utf-8', errors='ignore')
+                entry = next((candidate for candidate in _entry_candidate.finditer(text)
+                              if _starts_entry(text, candidate.start(), dialect)), None)
+                if entry:
+                    position += newline + len(text[:entry.start()].encode('utf-8')) + 1
+                    break
+            
+            if position >= size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+def _parse_shard(file_path, start, end, dialect, date_order, analyze, participants):
+    metrics = PipelineMetrics()
+    reader = ChatReader(file_path, dialect, date_order, start=start, end=end, participants=participants,
+                        metrics=metrics)
+    store = MessageStore.from_messages(reader)
+    analyzer = ChatAnalyzer(participants=participants).consume(store) if analyze else None
+    return store, analyzer, metrics
+
+def parse_chat_parallel(file_path, workers=None, analyze=True, participants=PARTICIPANTS, metrics=None):
+    """Parse (and analyze) a large export on several processes
+    
+    The file is cut into entry-aligned byte ranges, see shard_boundaries.
+    Each range is parsed into a MessageStore and counted by a ChatAnalyzer
+    in a worker process. The parent concatenates the stores and merges the
+    counters in file order, so the results match a serial run. Conversation
+    threads do not depend on the sharding at all: they are extracted from
+    the merged store.
     
+    Returns (messages, analytics); analytics is None unless analyze is set.
+    The shards' parse counters are added to metrics if given. Only plain
+    files can be sharded.
+    """
+    if chat_source_kind(file_path) != 'file':
+        raise ValueError("Parallel parsing needs a plain file, not an archive or stream")
+    workers = workers or os.cpu_count() or 1
+    shards = max(1, min(workers, os.path.getsize(file_path) // MIN_SHARD_SIZE))
+    dialect, date_order = sniff_chat_format(file_path)
+    
+    messages = MessageStore(date_order or 'dmy')
+    analyzer = ChatAnalyzer(participants=participants)
+    if dialect is None:
+        return messages, analyzer.results() if analyze else None
+    
+    ranges = shard_boundaries(file_path, shards, dialect)
+    if len(ranges) == 1:
+        results = [_parse_shard(file_path, 0, ranges[0][1], dialect, date_order, analyze, participants)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+            results = pool.map(_parse_shard, repeat(file_path), *zip(*ranges),
+                               repeat(dialect), repeat(date_order), repeat(analyze), repeat(participants))
+            results = list(results)
+    
+    for store, shard_analyzer, shard_metrics in results:
+        messages.extend(store)
+        if analyze:
+            analyzer.merge(shard_analyzer)
+        if metrics is not None:
+            metrics.merge(shard_metrics)
+    
+    return messages, analyzer.results() if analyze else None
+
+# Simplified milestone patterns - removed cute names
+MILESTONE_PATTERNS = {
+    "First 'I like you'": [
+        r'\bi\s+like\s+you\b',
+        r'\bi\s+really\s+like\s+you\b',
+        r'\byou\s+know\s+i\s+like\s+you\b'
+    ],
+    "First 'I love you'": [
+        r'\bi\s+love\s+you\b',
+        r'\blove\s+you\s+too\b',
+        r'\bi\s+really\s+love\s+you\b'
+    ],
+    "First video/voice call mention": [
+        r'\bcall\s+me\b', r'\bvideo\s+call\b', r'\bvoice\s+call\b',
+        r'\blet\'s\s+call\b', r'\bcalling\s+you\b'
+    ],
+    "First 'miss you'": [
+        r'\bi\s+miss\s+you\b', r'\bmissing\s+you\b', r'\bmiss\s+you\s+so\s+much\b'
+    ],
+    "First birthday wishes": [
+        r'\bhappy\s+birthday\b', r'\bbirthday\s+wishes\b', r'\bspecial\s+day\b'
+    ]
+}
+
+def compile_milestones(milestone_patterns):
+    """Combine all milestone patterns into one regex with a named group per pattern
+    
+    Returns the regex and a map from group name to (milestone, pattern).
+    """
+    groups = {}
+    alternatives = []
     for milestone_name, patterns in milestone_patterns.items():
+        for pattern in patterns:
+            group = f'm{len(groups)}'
+            groups[group] = (milestone_name, pattern)
+            alternatives.append(f'(?P<{group}>{pattern})')
+    return re.compile('|'.join(alternatives)), groups
+
+def find_relationship_milestones(messages, milestone_patterns=None):
+    """Find the first message of each special moment in your relationship
+    
+    Every message is lowercased and scanned once by a single combined regex.
+    A milestone leaves the regex as soon as it is found, and the scan stops
+    once all of them have been found.
+    """
+    if milestone_patterns is None:
+        milestone_patterns = MILESTONE_PATTERNS
+    
+    found = {}
+    remaining = dict(milestone_patterns)
+    matcher, groups = compile_milestones(remaining)
+    
+    for msg in messages:
+        text = msg['message'].lower()
+        match = matcher.search(text)
+        
+        while match:
+            milestone_name = groups[match.lastgroup][0]
+            # Report the milestone's first pattern that matches, not the leftmost hit
+            pattern = next(p for p in remaining[milestone_name] if re.search(p, text))
+            found[milestone_name] = {
+                'type': milestone_name,
+                'message': msg,
+                'found_pattern': pattern
+            }
+            
+            del remaining[milestone_name]
+            if not remaining:
+                break
+            # The same message may hold other milestones too
+            matcher, groups = compile_milestones(remaining)
+            match = matcher.search(text)
+        
+        if not remaining:
+            break
+    
+    return [found[name] for name in milestone_patterns if name in found]
+
+class ConversationSegmenter:
+    """Incremental state behind extract_conversations
+    
+    A message closes its thread when the thread is full or the next message
+    arrives more than CONVERSATION_GAP seconds later. Threads shorter than
+    min_length are not closed but run on into the next one.
+    """
+    
+    def __init__(self, min_length=5, max_length=15):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.conversations = []
+        self.current = []
+        self.previous = None
+    
+    def consume(self, messages):
+        """Extend the threads with an iterable of messages"""
+        min_length = self.min_length
+        max_length = self.max_length
+        conversations = self.conversations
+        current_conversation = self.current
+        previous = self.previous
+        
         for msg in messages:
-            for pattern in patterns:
-                if re.search(pattern, msg['message'].lower()):
-                    milestones.append({
-                        'type': milestone_name,
-                        'message': msg,
-                        'found_pattern': pattern
-                    })
-                    break
-        if any(m['type'] == milestone_name for m in milestones):
-            continue
+            # The gap to this message decides whether the previous one ended a thread
+            if (previous is not None and
+                msg['ts'] - previous['ts'] > CONVERSATION_GAP and
+                len(current_conversation) >= min_length):
+                conversations.append(current_conversation)
+                current_conversation = []
+            
+            current_conversation.append(msg)
+            previous = None
+            
+            if len(current_conversation) >= max_length:
+                if len(current_conversation) >= min_length:
+                    conversations.append(current_conversation)
+                    current_conversation = []
+            else:
+                previous = msg
+        
+        self.current = current_conversation
+        self.previous = previous
+        return self
     
-    return milestones
+    def results(self):
+        """All threads so far, the still open one included if it is long enough"""
+        if len(self.current) >= self.min_length:
+            return self.conversations + [list(self.current)]
+        return list(self.conversations)
+    
+    def state(self):
+        """The open thread; closed threads never change and are saved separately"""
+        return {
+            'current': [_pack_message(m) for m in self.current],
+            # The previous message is always the last one of the open thread
+            'has_previous': self.previous is not None
+        }
+    
+    def load_state(self, state):
+        self.conversations = []
+        self.current = [_unpack_message(m) for m in state['current']]
+        self.previous = self.current[-1] if state['has_previous'] else None
+        return self
 
-def extract_conversations(messages, min_length=5, max_length=15):
-    """Extract proper conversation threads"""
-    conversations = []
-    current_conversation = []
-    
-    for i, msg in enumerate(messages):
-        current_conversation.append(msg)
-        
-        is_end = False
-        
-        if len(current_conversation) >= max_length:
-            is_end = True
-        elif i < len(messages) - 1:
-            try:
-                current_time = datetime.strptime(f"{msg['date']} {msg['time']}", "%d/%m/%y %H:%M:%S")
-                next_time = datetime.strptime(f"{messages[i+1]['date']} {messages[i+1]['time']}", "%d/%m/%y %H:%M:%S")
-                time_gap = (next_time - current_time).total_seconds() / 3600
-                
-                if time_gap > 2:
-                    is_end = True
-            except:
-                pass
+def _pack_message(msg):
+    return [msg['date'], msg['time'], msg['sender'], msg['message'], msg['ts']]
+
+def _unpack_message(packed):
+    return dict(zip(('date', 'time', 'sender', 'message', 'ts'), packed))
+
+def _gap_boundaries(timestamps):
+    """Indices of the messages that come more than CONVERSATION_GAP after the one before"""
+    if np is not None:
+        if isinstance(timestamps, array) and timestamps.typecode == 'q':
+            ts = np.frombuffer(timestamps, dtype=np.int64)
         else:
-            is_end = True
-        
-        if is_end and len(current_conversation) >= min_length:
-            conversations.append(current_conversation.copy())
-            current_conversation = []
+            ts = np.asarray(timestamps, dtype=np.int64)
+        return (np.flatnonzero(np.diff(ts) > CONVERSATION_GAP) + 1).tolist()
+    
+    return [index for index, (before, after) in enumerate(zip(timestamps, islice(timestamps, 1, None)), 1)
+            if after - before > CONVERSATION_GAP]
+
+def conversation_ranges(timestamps, min_length=5, max_length=15):
+    """(start, end) index ranges of the threads extract_conversations finds
+    
+    Works from the timestamps alone, with the segmenter's rules applied per
+    stretch between two long gaps rather than per message: each stretch is
+    cut into max_length threads and a last piece shorter than min_length
+    runs on into the next stretch. The gaps are found with NumPy when it is
+    installed.
+    """
+    if max_length < min_length:
+        # The cap never closes a thread then; leave that odd case to the segmenter
+        indexed = ({'ts': ts, 'index': index} for index, ts in enumerate(timestamps))
+        return [(conv[0]['index'], conv[-1]['index'] + 1)
+                for conv in ConversationSegmenter(min_length, max_length).consume(indexed).results()]
+    
+    ranges = []
+    start = 0
+    for stop in _gap_boundaries(timestamps) + [len(timestamps)]:
+        full = start + (stop - start) // max_length * max_length
+        ranges.extend(zip(range(start, full, max_length), range(start + max_length, full + 1, max_length)))
+        if stop > full and stop - full >= min_length:
+            ranges.append((full, stop))
+            start = stop
+        else:
+            start = full
+    return ranges
+
+def gap_statistics(timestamps, percentiles=(50, 90, 99)):
+    """Summary of the seconds between consecutive messages
+    
+    Percentiles are linearly interpolated like numpy.percentile's default.
+    """
+    if np is not None:
+        if isinstance(timestamps, array) and timestamps.typecode == 'q':
+            gaps = np.diff(np.frombuffer(timestamps, dtype=np.int64))
+        else:
+            gaps = np.diff(np.asarray(timestamps, dtype=np.int64))
+        if not len(gaps):
+            return None
+        return {
+            'count': len(gaps),
+            'long_gaps': int(np.count_nonzero(gaps > CONVERSATION_GAP)),
+            'mean': float(gaps.mean()),
+            'max': int(gaps.max()),
+            'percentiles': dict(zip(percentiles, np.percentile(gaps, percentiles).tolist())),
+        }
+    
+    gaps = sorted(after - before for before, after in zip(timestamps, islice(timestamps, 1, None)))
+    if not gaps:
+        return None
+    
+    def percentile(q):
+        position = (len(gaps) - 1) * q / 100
+        low = int(position)
+        high = min(low + 1, len(gaps) - 1)
+        return gaps[low] + (gaps[high] - gaps[low]) * (position - low)
     
+    return {
+        'count': len(gaps),
+        'long_gaps': len(gaps) - bisect_right(gaps, CONVERSATION_GAP),
+        'mean': sum(gaps) / len(gaps),
+        'max': gaps[-1],
+        'percentiles': {q: float(percentile(q)) for q in percentiles},
+    }
+
+def extract_conversations(messages, min_length=5, max_length=15):
+    """Extract proper conversation threads
+    
+    Works on any iterable of messages, so it can consume the stream from
+    iter_whatsapp_messages directly. A MessageStore is split by
+    conversation_ranges from its timestamps, without walking the messages.
+    """
+    if isinstance(messages, MessageStore):
+        conversations = [[MessageRow(messages, index) for index in range(start, end)]
+                         for start, end in conversation_ranges(messages.timestamps, min_length, max_length)]
+    else:
+        conversations = ConversationSegmenter(min_length, max_length).consume(messages).results()
     print(f"📝 Extracted {len(conversations)} conversation threads")
     return conversations
 
-def analyze_chat_data(messages):
-    """Analyze chat for word frequency and special stats"""
-    your_messages = [m['message'] for m in messages if m['sender'] == 'Aaditya']
-    her_messages = [m['message'] for m in messages if m['sender'] == 'Shloka']
+# Keyword families counted per sender. A message scores once for every
+# listed word it contains, so overlapping spellings add up.
+KEYWORD_FAMILIES = {
+    'sorry': ['Sorry', 'sorryyyy', 'sorry', 'sry', 'sori', 'sorri', 'apologise', 'apologize', 'my bad', 'forgive me'],
+    'love': ['love', 'miss', 'care', 'beautiful', 'gorgeous'],
+}
+
+# Most used words (excluding common words)
+EXCLUDED_WORDS = {'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'a', 'an', 'this', 'that', 'these', 'those', 'will', 'have', 'has', 'had', 'do', 'does', 'did', 'can', 'could', 'would', 'should', 'my', 'your', 'me', 'him', 'her', 'us', 'them'}
+
+# Words of three or more letters in lowercased text, the only ones that make
+# the top word lists. For pure ASCII text the ASCII-only variant is equivalent
+# and about twice as fast.
+WORD_PATTERN = re.compile(r'\b[a-z]{3,}\b')
+ASCII_WORD_PATTERN = re.compile(r'\b[a-z]{3,}\b', re.ASCII)
+
+def tokenize(text):
+    """Words of already lowercased text, as counted by the analyzer"""
+    pattern = ASCII_WORD_PATTERN if text.isascii() else WORD_PATTERN
+    return pattern.findall(text)
+
+# Messages buffered per sender before they are tokenized as one batch
+ANALYSIS_BATCH = 4096
+
+class ChatAnalyzer:
+    """Single-pass accumulator behind analyze_chat_data
     
-    # Count your "sorry"s
-    sorry_words = ['Sorry', 'sorryyyy', 'sorry', 'sry', 'sori', 'sorri', 'apologise', 'apologize', 'my bad', 'forgive me']
-    sorry_count = sum(1 for msg in your_messages 
-                     for word in sorry_words
-                     if word.lower() in msg.lower())
+    Messages are routed to a small per-sender batch. Each full batch is
+    lowercased and tokenized in one go, and every counter (words, keyword
+    families, message totals) is updated from that, for any number of
+    senders. The per-word work all happens in C: Counter.update over findall,
+    and map(operator.contains) for the keyword families.
     
-    # Most used words (excluding common words)
-    exclude_words = {'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'a', 'an', 'this', 'that', 'these', 'those', 'will', 'have', 'has', 'had', 'do', 'does', 'did', 'can', 'could', 'would', 'should', 'my', 'your', 'me', 'him', 'her', 'us', 'them'}
+    participants only decides who the legacy "your"/"her" results are about:
+    the first two of them, topped up with other senders in order of
+    appearance.
+    """
     
-    your_words = []
-    for msg in your_messages:
-        words = re.findall(r'\b[a-zA-Z]+\b', msg.lower())
-        your_words.extend([w for w in words if len(w) > 2 and w not in exclude_words])
+    def __init__(self, keyword_families=None, participants=PARTICIPANTS):
+        if keyword_families is None:
+            keyword_families = KEYWORD_FAMILIES
+        self.keyword_families = keyword_families
+        self.participants = () if participants is None else tuple(participants)
+        self._families = [
+            (family, tuple(Counter(word.lower() for word in words).items()))
+            for family, words in keyword_families.items()
+        ]
+        
+        self.message_counts = Counter()
+        self.words = {}
+        self.keywords = {}
+        self._pending = {}
     
-    her_words = []
-    for msg in her_messages:
-        words = re.findall(r'\b[a-zA-Z]+\b', msg.lower())
-        her_words.extend([w for w in words if len(w) > 2 and w not in exclude_words])
+    def consume(self, messages):
+        """Fold an iterable of messages into the counters"""
+        if isinstance(messages, MessageStore):
+            return self._consume_store(messages)
+        
+        pending = self._pending
+        buffered = 0
+        
+        for sender, message in map(itemgetter('sender', 'message'), messages):
+            batch = pending.get(sender)
+            if batch is None:
+                batch = pending[sender] = []
+            batch.append(message)
+            buffered += 1
+            if buffered >= ANALYSIS_BATCH:
+                self._flush_all()
+                buffered = 0
+        
+        self._flush_all()
+        return self
     
-    your_top_words = Counter(your_words).most_common(10)
-    her_top_words = Counter(her_words).most_common(10)
+    def _consume_store(self, store):
+        # Slice the raw UTF-8 and decode once per batch instead of once per message
+        pending = {}
+        buffered = 0
+        text = store.text
+        offsets = store.offsets
+        
+        for index, sender_id in enumerate(store.sender_ids):
+            batch = pending.get(sender_id)
+            if batch is None:
+                batch = pending[sender_id] = []
+            batch.append(text[offsets[index]:offsets[index + 1]])
+            buffered += 1
+            if buffered >= ANALYSIS_BATCH:
+                for sender_id, batch in pending.items():
+                    self._count(store.senders[sender_id], len(batch), b'\0'.join(batch).decode('utf-8'))
+                pending.clear()
+                buffered = 0
+        
+        for sender_id, batch in pending.items():
+            self._count(store.senders[sender_id], len(batch), b'\0'.join(batch).decode('utf-8'))
+        return self
     
-    # Love-related stats
-    love_words = ['love', 'miss', 'care', 'beautiful', 'gorgeous']
-    your_love_count = sum(1 for msg in your_messages 
-                         for word in love_words 
-                         if word.lower() in msg.lower())
+    def _flush_all(self):
+        for sender, batch in self._pending.items():
+            self._count(sender, len(batch), '\0'.join(batch))
+        self._pending.clear()
     
-    her_love_count = sum(1 for msg in her_messages 
-                        for word in love_words 
-                        if word.lower() in msg.lower())
+    def _count(self, sender, message_count, text):
+        """Update the counters from a NUL-joined batch of one sender's messages"""
+        if not message_count:
+            return
+        
+        words = self.words.get(sender)
+        if words is None:
+            words = self.words[sender] = Counter()
+            self.keywords[sender] = Counter()
+        self.message_counts[sender] += message_count
+        
+        # NUL never occurs in chat text, so it keeps word boundaries intact
+        text = text.lower()
+        words.update(tokenize(text))
+        for word in EXCLUDED_WORDS:
+            words.pop(word, None)
+        
+        lowered = text.split('\0')
+        keywords = self.keywords[sender]
+        for family, weights in self._families:
+            keywords[family] += sum(
+                weight * sum(map(contains, lowered, repeat(word)))
+                for word, weight in weights
+                if word in text
+            )
     
-    return {
-        'sorry_count': sorry_count,
-        'your_top_words': your_top_words,
-        'her_top_words': her_top_words,
-        'your_love_count': your_love_count,
-        'her_love_count': her_love_count
+    def results(self, top_n=10):
+        """Per-sender stats plus the two-person summary the viewer shows"""
+        senders = {
+            sender: {
+                'message_count': self.message_counts[sender],
+                'top_words': self.words[sender].most_common(top_n),
+                'keywords': {family: self.keywords[sender][family] for family in self.keyword_families},
+            }
+            for sender in self.words
+        }
+        
+        pair = list(self.participants[:2])
+        pair += [sender for sender in self.words if sender not in pair][:2 - len(pair)]
+        you, her = pair + [None] * (2 - len(pair))
+        
+        empty = Counter()
+        your_keywords = self.keywords.get(you, empty)
+        her_keywords = self.keywords.get(her, empty)
+        return {
+            'sorry_count': your_keywords['sorry'],
+            'your_top_words': self.words.get(you, empty).most_common(top_n),
+            'her_top_words': self.words.get(her, empty).most_common(top_n),
+            'your_love_count': your_keywords['love'],
+            'her_love_count': her_keywords['love'],
+            'participants': [you, her],
+            'senders': senders
+        }
+
+    def merge(self, other):
+        """Add another analyzer's counts, as if its messages had come after ours"""
+        self.message_counts.update(other.message_counts)
+        for sender, words in other.words.items():
+            if sender in self.words:
+                self.words[sender].update(words)
+                self.keywords[sender].update(other.keywords[sender])
+            else:
+                self.words[sender] = Counter(words)
+                self.keywords[sender] = Counter(other.keywords[sender])
+        return self
+    
+    def state(self):
+        return {
+            'message_counts': dict(self.message_counts),
+            'words': {sender: dict(words) for sender, words in self.words.items()},
+            'keywords': {sender: dict(keywords) for sender, keywords in self.keywords.items()}
+        }
+    
+    def load_state(self, state):
+        self.message_counts = Counter(state['message_counts'])
+        self.words = {sender: Counter(words) for sender, words in state['words'].items()}
+        self.keywords = {sender: Counter(keywords) for sender, keywords in state['keywords'].items()}
+        return self
+
+def analyze_chat_data(messages, keyword_families=None, participants=PARTICIPANTS):
+    """Analyze chat for word frequency and special stats
+    
+    Makes a single pass over any iterable of messages, so the stream from
+    iter_whatsapp_messages can be analyzed without materializing it.
+    Every sender gets stats, see ChatAnalyzer for participants.
+    """
+    return ChatAnalyzer(keyword_families, participants).consume(messages).results()
+
+# Upper bounds in seconds of the reply time buckets; the last bucket is open ended
+LATENCY_BUCKETS = (60, 5 * 60, 15 * 60, 60 * 60, 3 * 60 * 60, 12 * 60 * 60, 24 * 60 * 60)
+LATENCY_LABELS = ('<1m', '<5m', '<15m', '<1h', '<3h', '<12h', '<1d', '1d+')
+
+class ActivityAggregator:
+    """When the chat is active, counted in one pass over the epoch timestamps
+    
+    Fills flat integer arrays: messages per hour of the week (Monday 00:00
+    first), per day from the first day seen, and per sender. A message whose
+    sender differs from the previous one is a reply; the gap between the two
+    is bucketed by LATENCY_BUCKETS for the replying sender.
+    """
+    
+    def __init__(self):
+        self.hour_of_week = array('q', bytes(8 * 7 * 24))
+        self.first_day = None
+        self.days = array('q')
+        self.senders = Counter()
+        self.latency = {}
+        self._last = None
+    
+    def consume(self, messages):
+        """Fold an iterable of messages into the counters"""
+        if isinstance(messages, MessageStore):
+            pairs = zip(messages.timestamps, map(messages.senders.__getitem__, messages.sender_ids))
+        else:
+            pairs = map(itemgetter('ts', 'sender'), messages)
+        
+        hour_of_week = self.hour_of_week
+        sender_counts = self.senders
+        latency = self.latency
+        last_ts, last_sender = self._last or (None, None)
+        
+        for ts, sender in pairs:
+            day = ts // 86400
+            # The epoch was a Thursday
+            hour_of_week[(day + 3) % 7 * 24 + ts % 86400 // 3600] += 1
+            self._count_day(day)
+            sender_counts[sender] += 1
+            
+            if last_sender is not None and sender != last_sender:
+                buckets = latency.get(sender)
+                if buckets is None:
+                    buckets = latency[sender] = array('q', bytes(8 * len(LATENCY_LABELS)))
+                buckets[bisect_right(LATENCY_BUCKETS, max(0, ts - last_ts))] += 1
+            last_ts, last_sender = ts, sender
+        
+        if last_sender is not None:
+            self._last = (last_ts, last_sender)
+        return self
+    
+    def _count_day(self, day):
+        days = self.days
+        if self.first_day is None:
+            self.first_day = day
+        elif day < self.first_day:
+            self.days = days = array('q', bytes(8 * (self.first_day - day))) + days
+            self.first_day = day
+        
+        index = day - self.first_day
+        if index >= len(days):
+            days.extend(repeat(0, index + 1 - len(days)))
+        days[index] += 1
+    
+    def results(self):
+        """The small heatmap and chart payload the viewer draws"""
+        return {
+            'hour_of_week': list(self.hour_of_week),
+            'first_day': None if self.first_day is None else (_EPOCH + timedelta(days=self.first_day)).strftime('%Y-%m-%d'),
+            'days': list(self.days),
+            'senders': dict(self.senders),
+            'latency_buckets': list(LATENCY_LABELS),
+            'latency': {sender: list(buckets) for sender, buckets in self.latency.items()},
+        }
+    
+    def state(self):
+        return {
+            'hour_of_week': list(self.hour_of_week),
+            'first_day': self.first_day,
+            'days': list(self.days),
+            'senders': dict(self.senders),
+            'latency': {sender: list(buckets) for sender, buckets in self.latency.items()},
+            'last': self._last,
+        }
+    
+    def load_state(self, state):
+        self.hour_of_week = array('q', state['hour_of_week'])
+        self.first_day = state['first_day']
+        self.days = array('q', state['days'])
+        self.senders = Counter(state['senders'])
+        self.latency = {sender: array('q', buckets) for sender, buckets in state['latency'].items()}
+        self._last = state['last'] and tuple(state['last'])
+        return self
+
+def aggregate_activity(messages):
+    """Activity heatmap and reply time payload for the viewer, see ActivityAggregator"""
+    return ActivityAggregator().consume(messages).results()
+
+# Bump when the parser or the snapshot layout changes, so old snapshots are rebuilt
+SNAPSHOT_VERSION = 3
+
+# Bytes at the start of the export and just before the snapshot offset that
+# are hashed to make sure the already processed part has not changed
+SNAPSHOT_HASH_WINDOW = 64 * 1024
+
+def _content_hash(file_path, offset):
+    """Hash the head of the file and the bytes leading up to offset"""
+    window = SNAPSHOT_HASH_WINDOW
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        digest.update(file.read(min(offset, window)))
+        file.seek(max(0, offset - window))
+        digest.update(file.read(offset - max(0, offset - window)))
+    return digest.hexdigest()
+
+class ConversationLog:
+    """Closed conversation threads of earlier incremental runs, read lazily
+    
+    Stands in for the list of the first `count` threads in the log, plus
+    the threads in tail. Logged threads are only read and decoded while
+    iterating, so a run that finds nothing new never touches the log, and
+    only one of them is in memory at a time.
+    """
+    
+    def __init__(self, log_path, size, count, tail=()):
+        self.log_path = log_path
+        self.size = size
+        self.count = count
+        self.tail = list(tail)
+    
+    def __len__(self):
+        return self.count + len(self.tail)
+    
+    def __iter__(self):
+        if self.size:
+            with open(self.log_path, 'rb') as log:
+                # Later runs may have appended more threads, only the first count are ours
+                for line in islice(log, self.count):
+                    yield [_unpack_message(m) for m in json.loads(line)]
+        yield from self.tail
+
+def load_chat_snapshot(snapshot_path):
+    """Read a snapshot written by save_chat_snapshot, or None if there is no usable one"""
+    try:
+        with gzip.open(snapshot_path, 'rt', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def save_chat_snapshot(snapshot_path, snapshot):
+    """Write a snapshot atomically, so an interrupted run never leaves a broken one"""
+    temp_path = f"{snapshot_path}.tmp"
+    with gzip.open(temp_path, 'wt', encoding='utf-8', compresslevel=6) as file:
+        json.dump(snapshot, file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_path, snapshot_path)
+
+def analyze_chat_incremental(file_path, snapshot_path, min_length=4, max_length=12, participants=PARTICIPANTS,
+                             metrics=None):
+    """Analyze a chat and extract its conversations, reusing the last run's work
+    
+    Analyzer and activity counters, the open conversation thread and the parser's position
+    are checkpointed to snapshot_path; closed threads never change and are
+    appended to a log next to it. When the export still starts with the same
+    bytes up to the checkpoint, only the lines appended since are parsed and
+    counted. Otherwise everything is rebuilt, and so it is when the last run
+    could only guess the day/month order. Zip and gzip exports and file
+    objects cannot be resumed part way: they are read whole every time and
+    nothing is checkpointed.
+    
+    Returns (analytics, conversations), the analytics including the
+    ActivityAggregator results as 'activity' and the export's day/month
+    order as 'date_order', and the conversations a ConversationLog over the
+    threads of earlier runs. Each stage is timed into
+    metrics if given, along with the parse counters.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    config = {
+        'version': SNAPSHOT_VERSION,
+        'parser_version': PARSER_VERSION,
+        'min_length': min_length,
+        'max_length': max_length,
+        'keyword_families': KEYWORD_FAMILIES,
+        'participants': None if participants is None else list(participants)
     }
+    log_path = f"{snapshot_path}.conversations"
+    
+    analyzer = ChatAnalyzer(participants=participants)
+    activity = ActivityAggregator()
+    segmenter = ConversationSegmenter(min_length, max_length)
+    reader = ChatReader(file_path, hold_last=True, participants=participants, metrics=metrics)
+    log_size = log_count = 0
+    
+    resumable = chat_source_kind(file_path) == 'file'
+    snapshot = load_chat_snapshot(snapshot_path) if resumable else None
+    # A day/month order that was only guessed may still turn out wrong: rebuild
+    if (snapshot and snapshot['config'] == config and snapshot['date_order'] and
+        os.path.getsize(file_path) >= snapshot['offset'] and
+        os.path.exists(log_path) and os.path.getsize(log_path) >= snapshot['log_size'] and
+        _content_hash(file_path, snapshot['offset']) == snapshot['hash']):
+        analyzer.load_state(snapshot['analyzer'])
+        activity.load_state(snapshot['activity'])
+        segmenter.load_state(snapshot['segmenter'])
+        reader = ChatReader(file_path, snapshot['dialect'], snapshot['date_order'],
+                            start=snapshot['offset'], hold_last=True, participants=participants,
+                            metrics=metrics)
+        log_size = snapshot['log_size']
+        log_count = snapshot['log_count']
+        metrics.count('resumed_from_byte', snapshot['offset'])
+        print(f"♻️ Resuming from byte {snapshot['offset']}")
+    
+    def consume(batch):
+        with metrics.stage('conversations'):
+            segmenter.consume(batch)
+        with metrics.stage('analytics'):
+            analyzer.consume(batch)
+        with metrics.stage('activity'):
+            activity.consume(batch)
+    
+    messages = iter(reader)
+    while True:
+        with metrics.stage('parse'):
+            batch = list(islice(messages, ANALYSIS_BATCH))
+        if not batch:
+            break
+        consume(batch)
+    
+    # Checkpoint before the held back last entry, which may still grow.
+    # Anything an interrupted run appended past log_size is dropped first.
+    earlier = (log_path, log_size, log_count)
+    if resumable:
+        with metrics.stage('snapshot'):
+            with open(log_path, 'a+b') as log:
+                log.truncate(log_size)
+                log.seek(log_size)
+                for conv in segmenter.conversations:
+                    log.write(json.dumps([_pack_message(m) for m in conv], ensure_ascii=False).encode('utf-8') + b'\n')
+                log_size = log.tell()
+            
+            save_chat_snapshot(snapshot_path, {
+                'config': config,
+                'offset': reader.offset,
+                'hash': _content_hash(file_path, reader.offset),
+                'dialect': reader.dialect,
+                'date_order': reader.date_order,
+                'log_size': log_size,
+                'log_count': log_count + len(segmenter.conversations),
+                'analyzer': analyzer.state(),
+                'activity': activity.state(),
+                'segmenter': segmenter.state()
+            })
+    
+    with metrics.stage('parse'):
+        held = reader.read_held()
+    consume(held)
+    
+    conversations = ConversationLog(*earlier, tail=segmenter.results())
+    print(f"📝 Extracted {len(conversations)} conversation threads")
+    return dict(analyzer.results(), activity=activity.results(), date_order=reader.date_order or 'dmy'), conversations
+
+# Full-text search
+INDEX_MAGIC = b'CHATIDX2'
+
+def _encode_postings(ids):
+    """Delta + varint encode a sorted list of message ids"""
+    out = bytearray()
+    previous = 0
+    for message_id in ids:
+        delta = message_id - previous
+        previous = message_id
+        while delta >= 0x80:
+            out.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+def _decode_postings(data):
+    ids = []
+    message_id = value = shift = 0
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        else:
+            message_id += value | byte << shift
+            ids.append(message_id)
+            value = shift = 0
+    return ids
 
-def generate_clean_html(messages, analytics):
-    """Generate clean and simple HTML for your girlfriend."""
+class MessageIndex:
+    """Inverted index from words to the messages that contain them
     
-    if not messages:
-        return "<html><body><h1>No messages found!</h1></body></html>"
+    Words come from the same tokenizer as analyze_chat_data. Every posting
+    list is delta + varint encoded in one blob and only decoded (and then
+    cached) when a query touches it. The indexed MessageStore is kept with
+    it, for phrase checks and to return the matching messages. key is the
+    message_cache_key of the export it was built from, if known.
+    """
     
-    conversations = extract_conversations(messages, min_length=4, max_length=12)
+    def __init__(self, messages, terms, postings, key=None):
+        self.messages = messages
+        self.terms = terms
+        self.postings = postings
+        self.key = key
+        self.chronological = all(map(le, messages.timestamps, messages.timestamps[1:]))
+        self._decoded = {}
     
-    conversations_json = json.dumps([
-        [{
-            'date': m['date'],
-            'time': m['time'],
-            'sender': m['sender'],
-            'message': m['message']
-        } for m in conv] for conv in conversations
-    ])
+    @classmethod
+    def build(cls, messages, key=None):
+        if not isinstance(messages, MessageStore):
+            messages = MessageStore.from_messages(messages)
+        
+        words = {}
+        for message_id in range(len(messages)):
+            for word in set(tokenize(messages.message_text(message_id).lower())):
+                ids = words.get(word)
+                if ids is None:
+                    ids = words[word] = []
+                ids.append(message_id)
+        
+        terms = {}
+        postings = bytearray()
+        for word in sorted(words):
+            encoded = _encode_postings(words[word])
+            terms[word] = (len(postings), len(encoded), len(words[word]))
+            postings += encoded
+        return cls(messages, terms, bytes(postings), key)
     
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Our Beautiful Conversations </title>
-        <style>
+    def save(self, path):
+        """Write the index and its messages to one container file, see write_container"""
+        header, sections = _store_sections(self.messages)
+        write_container(path, INDEX_MAGIC, dict(header, terms=self.terms, key=self.key),
+                        [self.postings] + sections)
+    
+    @classmethod
+    def load(cls, path):
+        """Map a saved index in place, like load_message_cache; raises ValueError if it is damaged"""
+        header, sections = map_container(path, INDEX_MAGIC)
+        try:
+            messages = _mapped_store(header, sections[1:])
+            terms = {word: tuple(entry) for word, entry in header['terms'].items()}
+        except (AttributeError, IndexError, KeyError, TypeError) as e:
+            raise ValueError(f"{path} is not a valid message index") from e
+        return cls(messages, terms, sections[0], header.get('key'))
+    
+    def term(self, word):
+        """Sorted ids of the messages containing a word"""
+        ids = self._decoded.get(word)
+        if ids is None:
+            entry = self.terms.get(word)
+            if entry is None:
+                return []
+            start, size, _ = entry
+            ids = self._decoded[word] = _decode_postings(self.postings[start:start + size])
+        return ids
+    
+    def _date_range(self, start, end):
+        """Ids from start (inclusive) to end (exclusive), as epoch seconds or datetimes"""
+        if isinstance(start, datetime):
+            start = int((start - _EPOCH).total_seconds())
+        if isinstance(end, datetime):
+            end = int((end - _EPOCH).total_seconds())
+        timestamps = self.messages.timestamps
+        
+        if self.chronological:
+            low = 0 if start is None else bisect_left(timestamps, start)
+            high = len(timestamps) if end is None else bisect_left(timestamps, end)
+            return range(low, high)
+        return [i for i, ts in enumerate(timestamps)
+                if (start is None or ts >= start) and (end is None or ts < end)]
+    
+    def search(self, query='', start=None, end=None):
+        """Ids of the messages matching every part of a query, oldest first
+        
+        Bare words must all occur, "quoted phrases" must occur as written
+        (ignoring case and punctuation), and start/end limit the date range.
+        Words the tokenizer skips, like ones under three letters, are checked
+        against the message text like phrases, which means a scan when the
+        query has nothing else to narrow it down.
+        """
+        phrases = []
+        words = set()
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query.lower()):
+            tokens = tokenize(phrase or word)
+            words.update(tokens)
+            if phrase or tokens != [word]:
+                parts = re.findall(r'\w+', phrase or word)
+                if parts:
+                    phrases.append(re.compile(r'(?<!\w)' + r'\W+'.join(map(re.escape, parts)) + r'(?!\w)'))
+        
+        if words:
+            lists = sorted((self.term(word) for word in words), key=len)
+            ids = lists[0]
+            if len(lists) > 1:
+                ids = sorted(set(ids).intersection(*lists[1:]))
+            if start is not None or end is not None:
+                dates = self._date_range(start, end)
+                if not self.chronological:
+                    dates = set(dates)
+                ids = [i for i in ids if i in dates]
+        else:
+            ids = self._date_range(start, end)
+        
+        if phrases:
+            text = self.messages.message_text
+            ids = [i for i in ids if all(phrase.search(text(i).lower()) for phrase in phrases)]
+        return list(ids)
+    
+    def __getitem__(self, message_id):
+        return self.messages[message_id]
+
+def build_message_index(messages, index_path=None, key=None):
+    """Index parsed messages for search, saving the index if a path is given"""
+    index = MessageIndex.build(messages, key)
+    if index_path is not None:
+        index.save(index_path)
+    print(f"🔎 Indexed {len(index.terms)} words in {len(index.messages)} messages")
+    return index
+
+def update_message_index(file_path, index_path, participants=PARTICIPANTS, metrics=None):
+    """Keep a saved search index of an export current
+    
+    The index records the export's message_cache_key. While that still
+    matches, the saved index is mapped back in; otherwise the export is
+    parsed and indexed again. Hits are counted in metrics as 'index_hits'.
+    """
+    key = message_cache_key(file_path, participants)
+    try:
+        index = MessageIndex.load(index_path)
+        if index.key == key:
+            if metrics is not None:
+                metrics.count('index_hits')
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_message_index(parse_whatsapp_chat(file_path, participants=participants), index_path, key)
+
+def _write_json_array(fp, items):
+    """Write a JSON array item by item, escaped to sit inside a script element"""
+    fp.write('[')
+    for index, item in enumerate(items):
+        if index:
+            fp.write(', ')
+        fp.write(json.dumps(item).replace('</', '<\\/'))
+    fp.write(']')
+
+def _compact_conversation(conversation, sender_index):
+    """Pack a conversation as [start minute, sender ids, minute offsets, texts]"""
+    start = conversation[0]['ts'] // 60
+    return [
+        start,
+        [sender_index.setdefault(m['sender'], len(sender_index)) for m in conversation],
+        [m['ts'] // 60 - start for m in conversation],
+        [m['message'] for m in conversation],
+    ]
+
+class _CompressedPayloadWriter:
+    """Text sink that gzips and base64-encodes into a {"gzip": ...} JSON object"""
+    
+    def __init__(self, fp):
+        self.fp = fp
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.pending = b''
+        fp.write('{"gzip": "')
+    
+    def write(self, text):
+        self._emit(self.compressor.compress(text.encode('utf-8')))
+    
+    def _emit(self, data, final=False):
+        # base64 is only streamable in whole 3-byte groups
+        data = self.pending + data
+        cut = len(data) if final else len(data) - len(data) % 3
+        self.fp.write(base64.b64encode(data[:cut]).decode('ascii'))
+        self.pending = data[cut:]
+    
+    def close(self):
+        self._emit(self.compressor.flush(), final=True)
+        self.fp.write('"}')
+
+class ConversationSearchIndex:
+    """Word to conversation ids map behind the viewer's search box
+    
+    Words come from the analyzer's tokenizer. It is written as the sorted
+    words plus, for each, its delta encoded conversation ids, so the page
+    can binary search it for whole words and prefixes.
+    """
+    
+    def __init__(self):
+        self.words = {}
+    
+    def add(self, conversation_id, conversation):
+        """Index a conversation; ids must be added in increasing order"""
+        words = set()
+        for m in conversation:
+            words.update(tokenize(m['message'].lower()))
+        for word in words:
+            ids = self.words.get(word)
+            if ids is None:
+                ids = self.words[word] = []
+            ids.append(conversation_id)
+    
+    def write(self, fp, compress=False):
+        out = _CompressedPayloadWriter(fp) if compress else fp
+        words = sorted(self.words)
+        out.write('{"terms": ' + json.dumps(words) + ', "ids": ')
+        _write_json_array(out, ([b - a for a, b in zip([0] + ids, ids)] for ids in map(self.words.get, words)))
+        out.write('}')
+        if compress:
+            out.close()
+
+def write_conversation_payload(fp, conversations, compress=False, search_index=None, first_id=0):
+    """Stream conversations to fp in the compact format the viewer reads
+    
+    The payload is {"conversations": [...], "senders": [...]} where every
+    conversation is column arrays (see _compact_conversation) indexing into
+    the sender table, and times are whole minutes. With compress it is
+    gzipped and wrapped as {"gzip": "<base64>"} for the browser to inflate.
+    Conversations are also added to search_index if given, numbered from
+    first_id.
+    """
+    out = _CompressedPayloadWriter(fp) if compress else fp
+    sender_index = {}
+    
+    def packed():
+        for conversation_id, conversation in enumerate(conversations, first_id):
+            if search_index is not None:
+                search_index.add(conversation_id, conversation)
+            yield _compact_conversation(conversation, sender_index)
+    
+    out.write('{"conversations": ')
+    _write_json_array(out, packed())
+    out.write(', "senders": ' + json.dumps(list(sender_index)).replace('</', '<\\/') + '}')
+    if compress:
+        out.close()
+
+def _chunk_file_url(chunk_dir, chunk_url, name):
+    """How the page fetches a file written to chunk_dir, see write_conversation_chunks"""
+    if chunk_url is None:
+        chunk_url = os.path.basename(os.path.normpath(chunk_dir))
+    return f"{chunk_url}/{name}" if chunk_url else name
+
+def write_conversation_chunks(conversations, chunk_dir, chunk_url=None, compress=False, search_index=None):
+    """Write conversations to one JSON file per month of their first message
+    
+    Each file is a payload written by write_conversation_payload.
+    Returns the manifest the page uses to fetch them: a list of
+    {'url', 'month', 'start', 'count'} in conversation order, where start is
+    the index of the chunk's first conversation. Files are referenced as
+    chunk_url/name, chunk_url defaulting to the directory's own name so the
+    page can sit next to it.
+    """
+    os.makedirs(chunk_dir, exist_ok=True)
+    
+    months = {}
+    for conversation in conversations:
+        month = (_EPOCH + timedelta(seconds=conversation[0]['ts'])).strftime('%Y-%m')
+        months.setdefault(month, []).append(conversation)
+    
+    manifest = []
+    start = 0
+    for month in sorted(months):
+        name = f"conversations-{month}.json"
+        with open(os.path.join(chunk_dir, name), 'w', encoding='utf-8') as file:
+            write_conversation_payload(file, months[month], compress, search_index, start)
+        
+        manifest.append({
+            'url': _chunk_file_url(chunk_dir, chunk_url, name),
+            'month': month,
+            'start': start,
+            'count': len(months[month]),
+        })
+        start += len(months[month])
+    
+    return manifest
+
+# Scripts for drawing the sampled conversations in the viewer
+VIEWER_RENDERERS = {
+    'batched': """
+            // Every conversation is built off-document from cloned prototypes and
+            // inserted at once; a single requestAnimationFrame loop then reveals
+            // the messages. Chat text only ever goes into text nodes.
+            const messagePrototype = document.createElement('div');
+            messagePrototype.innerHTML = '<div class="message-bubble"></div><div class="message-time"></div>';
+            let revealQueue = [];
+            let revealFrame = null;
+            
+            function revealMessages(now) {
+                while (revealQueue.length && revealQueue[0].at <= now) {
+                    revealQueue.shift().element.classList.add('show');
+                }
+                revealFrame = revealQueue.length ? requestAnimationFrame(revealMessages) : null;
+            }
+            
+            function renderConversations(container, selectedConversations) {
+                const fragment = document.createDocumentFragment();
+                const start = performance.now();
+                const reveals = [];
+                
+                selectedConversations.forEach(conversation => {
+                    const conversationDiv = document.createElement('div');
+                    conversationDiv.className = 'conversation';
+                    
+                    const header = document.createElement('div');
+                    header.className = 'conversation-header';
+                    const date = document.createElement('div');
+                    date.className = 'conversation-date';
+                    date.textContent = `${conversation[0].date} • ${conversation.length} messages`;
+                    header.appendChild(date);
+                    conversationDiv.appendChild(header);
+                    
+                    conversation.forEach((msg, msgIndex) => {
+                        const messageDiv = messagePrototype.cloneNode(true);
+                        messageDiv.className = `message ${msg.sender === yourName ? 'you' : 'her'}`;
+                        messageDiv.firstChild.textContent = msg.message;
+                        messageDiv.lastChild.textContent = msg.time;
+                        conversationDiv.appendChild(messageDiv);
+                        reveals.push({ at: start + (msgIndex + 1) * 100, element: messageDiv }); // Small delay between messages
+                    });
+                    
+                    fragment.appendChild(conversationDiv);
+                });
+                
+                container.replaceChildren(fragment);
+                revealQueue = reveals.sort((a, b) => a.at - b.at);
+                if (revealFrame === null) revealFrame = requestAnimationFrame(revealMessages);
+            }
+""",
+    'timers': """
+            // One timer and one innerHTML write per message; chat text is not escaped
+            function renderConversations(container, selectedConversations) {
+                container.innerHTML = ''; // Clear loading message
+                
+                selectedConversations.forEach((conversation, convIndex) => {
+                    const conversationDiv = document.createElement('div');
+                    conversationDiv.className = 'conversation';
+                    
+                    const firstMsg = conversation[0];
+                    conversationDiv.innerHTML = `
+                        <div class="conversation-header">
+                            <div class="conversation-date">${firstMsg.date} • ${conversation.length} messages</div>
+                        </div>
+                    `;
+                    
+                    // Use a promise or callback chain for sequential message display
+                    let messageDelay = 0;
+                    conversation.forEach((msg, msgIndex) => {
+                        messageDelay += 100; // Small delay between messages
+                        setTimeout(() => {
+                            const messageDiv = document.createElement('div');
+                            messageDiv.className = `message ${msg.sender === yourName ? 'you' : 'her'}`;
+                            
+                            messageDiv.innerHTML = `
+                                <div class="message-bubble">
+                                    ${msg.message}
+                                </div>
+                                <div class="message-time">${msg.time}</div>
+                            `;
+                            
+                            conversationDiv.appendChild(messageDiv);
+                            setTimeout(() => messageDiv.classList.add('show'), 10); // Add show class for animation
+                        }, messageDelay);
+                    });
+                    
+                    // Append the whole conversation after its messages are scheduled
+                    setTimeout(() => {
+                        container.appendChild(conversationDiv);
+                    }, messageDelay + 200); // Small extra delay before adding next conversation
+                });
+            }
+""",
+}
+
+# Stylesheet of the viewer page
+VIEWER_CSS = """
             /* --- Variables for easy customization --- */
-            :root {{
+            :root {
                 --primary-color: #6A5ACD; /* Slate Blue for main accents */
                 --secondary-color: #FF69B4; /* Hot Pink for Shloka's messages/accents */
                 --background-light: #F0F8FF; /* Alice Blue, very light */
@@ -217,15 +2056,15 @@ def generate_clean_html(messages, analytics):
                 --shadow-light: rgba(0,0,0,0.05);
                 --shadow-medium: rgba(0,0,0,0.08);
                 --shadow-strong: rgba(0,0,0,0.1);
-            }}
+            }
             
-            * {{
+            * {
                 margin: 0;
                 padding: 0;
                 box-sizing: border-box;
-            }}
+            }
             
-            body {{
+            body {
                 font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; /* A bit more friendly */
                 background: var(--background-light);
                 color: var(--text-dark);
@@ -235,9 +2074,9 @@ def generate_clean_html(messages, analytics):
                 align-items: center;
                 min-height: 100vh; /* Full viewport height */
                 padding: 20px;
-            }}
+            }
             
-            .container {{
+            .container {
                 max-width: 1000px;
                 width: 100%; /* Ensure it takes full width within max-width */
                 margin: 0 auto;
@@ -245,43 +2084,43 @@ def generate_clean_html(messages, analytics):
                 border-radius: 25px; /* More pronounced rounded corners for the whole container */
                 box-shadow: 0 10px 30px rgba(0,0,0,0.08); /* Stronger overall shadow */
                 background: var(--card-background); /* White background for the main content area */
-            }}
+            }
             
-            .header {{
+            .header {
                 text-align: center;
                 margin-bottom: 40px;
                 padding: 40px 20px;
                 background: linear-gradient(145deg, var(--background-light), #E6E6FA); /* Very subtle gradient header */
                 border-radius: 20px;
                 box-shadow: 0 4px 20px var(--shadow-light);
-            }}
+            }
             
-            .header h1 {{
+            .header h1 {
                 font-size: 2.8rem;
                 font-weight: 700;
                 color: var(--primary-color);
                 margin-bottom: 12px;
                 text-shadow: 1px 1px 3px rgba(0,0,0,0.05);
-            }}
+            }
             
-            .header p {{
+            .header p {
                 font-size: 1.2rem;
                 color: var(--text-medium);
-            }}
+            }
             
-            .main-content {{
+            .main-content {
                 display: grid;
                 grid-template-columns: 300px 1fr;
                 gap: 30px;
-            }}
+            }
             
-            .sidebar {{
+            .sidebar {
                 display: flex;
                 flex-direction: column;
                 gap: 20px;
-            }}
+            }
             
-            .chat-section {{
+            .chat-section {
                 background: var(--card-background);
                 border-radius: 20px;
                 padding: 30px;
@@ -289,29 +2128,29 @@ def generate_clean_html(messages, analytics):
                 min-height: 70vh;
                 display: flex;
                 flex-direction: column;
-            }}
+            }
             
-            .stats-card {{
+            .stats-card {
                 background: var(--card-background);
                 border-radius: 18px; /* Softer radius */
                 padding: 25px; /* More padding */
                 box-shadow: 0 4px 15px var(--shadow-light);
                 transition: transform 0.2s ease-in-out, box-shadow 0.2s ease-in-out;
-            }}
-            .stats-card:hover {{
+            }
+            .stats-card:hover {
                 transform: translateY(-3px);
                 box-shadow: 0 6px 20px var(--shadow-medium);
-            }}
+            }
             
-            .stats-card h3 {{
+            .stats-card h3 {
                 color: var(--primary-color);
                 font-size: 1.25rem;
                 font-weight: 600;
                 margin-bottom: 20px;
                 text-align: center;
-            }}
+            }
             
-            .sorry-counter {{
+            .sorry-counter {
                 background: linear-gradient(135deg, var(--primary-color), #8A2BE2); /* Blend with a deeper purple */
                 color: white;
                 text-align: center;
@@ -319,28 +2158,28 @@ def generate_clean_html(messages, analytics):
                 border-radius: 18px;
                 margin-bottom: 20px;
                 box-shadow: 0 6px 20px rgba(0,0,0,0.1);
-            }}
+            }
             
-            .sorry-counter .number {{
+            .sorry-counter .number {
                 font-size: 3.5rem;
                 font-weight: bold;
                 display: block;
-            }}
+            }
             
-            .sorry-counter .label {{
+            .sorry-counter .label {
                 font-size: 1rem;
                 margin-top: 8px;
                 opacity: 0.95;
                 font-weight: 500;
-            }}
+            }
             
-            .word-list {{
+            .word-list {
                 display: flex;
                 flex-direction: column;
                 gap: 10px; /* Slightly more space */
-            }}
+            }
             
-            .word-item {{
+            .word-item {
                 display: flex;
                 justify-content: space-between;
                 align-items: center;
@@ -350,32 +2189,32 @@ def generate_clean_html(messages, analytics):
                 font-size: 0.95rem;
                 border: 1px solid var(--border-light);
                 transition: transform 0.2s ease-in-out, box-shadow 0.2s ease-in-out;
-            }}
+            }
             
-            .word-item:hover {{
+            .word-item:hover {
                 transform: translateY(-3px);
                 box-shadow: 0 4px 12px var(--shadow-medium);
-            }}
+            }
             
-            .word-item.you {{
+            .word-item.you {
                 border-left: 5px solid var(--bubble-you-bg);
-            }}
+            }
             
-            .word-item.her {{
+            .word-item.her {
                 border-left: 5px solid var(--bubble-her-bg);
-            }}
+            }
             
-            .word-count {{
+            .word-count {
                 font-weight: 700;
                 color: var(--primary-color);
-            }}
+            }
             
-            .controls {{
+            .controls {
                 text-align: center;
                 margin-bottom: 30px;
-            }}
+            }
             
-            .refresh-btn {{
+            .refresh-btn {
                 background: linear-gradient(45deg, var(--primary-color), #8A2BE2);
                 color: white;
                 border: none;
@@ -386,95 +2225,134 @@ def generate_clean_html(messages, analytics):
                 cursor: pointer;
                 box-shadow: 0 6px 20px rgba(106, 90, 205, 0.4);
                 transition: all 0.3s ease;
-            }}
+            }
             
-            .refresh-btn:hover {{
+            .search-box {
+                display: block;
+                width: 100%;
+                margin-top: 20px;
+                padding: 12px 20px;
+                border: 1px solid var(--border-light);
+                border-radius: 30px;
+                font-size: 1rem;
+                color: var(--text-dark);
+                box-shadow: 0 2px 10px var(--shadow-light);
+            }
+            
+            .search-status {
+                margin-top: 8px;
+                font-size: 0.9rem;
+                color: var(--text-medium);
+            }
+            
+            .refresh-btn:hover {
                 background: linear-gradient(45deg, #8A2BE2, var(--primary-color)); /* Invert gradient on hover */
                 transform: translateY(-3px) scale(1.02);
                 box-shadow: 0 8px 25px rgba(106, 90, 205, 0.5);
-            }}
+            }
             
-            .conversation {{
+            .conversation {
                 background: var(--background-light); /* Lighter background for conversations */
                 border-radius: 18px;
                 padding: 25px;
                 margin-bottom: 25px;
                 border: 1px solid var(--border-light);
                 box-shadow: 0 2px 10px var(--shadow-light);
-            }}
+            }
             
-            .conversation-header {{
+            .conversation-header {
                 text-align: center;
                 margin-bottom: 20px;
                 padding-bottom: 10px;
                 border-bottom: 1px dashed var(--border-light); /* Dashed line for softness */
-            }}
+            }
             
-            .conversation-date {{
+            .conversation-date {
                 font-size: 1.05rem;
                 color: var(--primary-color);
                 font-weight: 600;
-            }}
+            }
             
-            .message {{
+            .message {
                 margin: 15px 0;
                 display: flex;
                 flex-direction: column;
                 opacity: 0; /* Start invisible for animation */
                 transform: translateY(20px); /* Start slightly below */
                 transition: opacity 0.4s ease-out, transform 0.4s ease-out; /* Smooth transition */
-            }}
+            }
             
-            .message.show {{
+            .message.show {
                 opacity: 1;
                 transform: translateY(0);
-            }}
+            }
             
-            .message.you {{ 
+            .message.you { 
                 align-items: flex-end; 
-            }}
+            }
             
-            .message.her {{ 
+            .message.her { 
                 align-items: flex-start; 
-            }}
+            }
             
-            .message-bubble {{
+            .message-bubble {
                 max-width: 70%;
                 padding: 14px 20px;
                 border-radius: 25px;
                 word-wrap: break-word;
                 font-size: 1rem;
                 box-shadow: 0 2px 8px var(--shadow-light);
-            }}
+            }
             
-            .message.you .message-bubble {{
+            .message.you .message-bubble {
                 background: var(--bubble-you-bg);
                 color: var(--bubble-you-text);
                 border-bottom-right-radius: 8px;
-            }}
+            }
             
-            .message.her .message-bubble {{
+            .message.her .message-bubble {
                 background: var(--bubble-her-bg);
                 color: var(--bubble-her-text);
                 border-bottom-left-radius: 8px;
-            }}
+            }
             
-            .message-time {{
+            .message-time {
                 font-size: 0.8rem;
                 opacity: 0.7;
                 margin-top: 6px;
                 font-weight: 400;
                 color: var(--text-medium);
-            }}
+            }
+            
+            .heatmap {
+                display: grid;
+                grid-template-columns: auto repeat(24, 1fr);
+                gap: 2px;
+                font-size: 0.7rem;
+                color: var(--text-medium);
+            }
+            
+            .heatmap-cell {
+                aspect-ratio: 1;
+                border-radius: 2px;
+                background: var(--primary-color);
+            }
+            
+            .activity-note {
+                margin: 15px 0;
+                font-size: 0.9rem;
+                color: var(--text-medium);
+                text-align: center;
+            }
             
-            .simple-stats {{
+            .simple-stats {
                 display: grid;
                 grid-template-columns: 1fr 1fr;
                 gap: 15px; /* More space */
                 margin-top: 20px; /* More margin */
-            }}
+            }
             
-            .simple-stat {{
+            .simple-stat {
                 text-align: center;
                 padding: 15px;
                 background: var(--background-light);
@@ -482,91 +2360,101 @@ def generate_clean_html(messages, analytics):
                 border: 1px solid var(--border-light);
                 box-shadow: 0 2px 8px var(--shadow-light);
                 transition: transform 0.2s ease-in-out, background 0.2s ease-in-out;
-            }}
-            .simple-stat:hover {{
+            }
+            .simple-stat:hover {
                 transform: translateY(-2px);
                 background: #EAF7FF; /* Slightly different hover background */
-            }}
+            }
             
-            .simple-stat .number {{
+            .simple-stat .number {
                 font-size: 1.8rem; /* Larger numbers */
                 font-weight: 700;
                 color: var(--primary-color);
                 margin-bottom: 5px;
-            }}
+            }
             
-            .simple-stat .label {{
+            .simple-stat .label {
                 font-size: 0.9rem;
                 color: var(--text-medium);
                 margin-top: 3px;
-            }}
+            }
             
-            .loading {{
+            .loading {
                 text-align: center;
                 padding: 40px;
                 color: var(--text-medium);
                 font-size: 1.2rem;
                 animation: pulse 1.5s infinite alternate; /* Loading animation */
-            }}
+            }
 
-            @keyframes pulse {{
-                from {{ opacity: 0.7; }}
-                to {{ opacity: 1; }}
-            }}
+            @keyframes pulse {
+                from { opacity: 0.7; }
+                to { opacity: 1; }
+            }
             
-            @media (max-width: 768px) {{
-                .main-content {{
+            @media (max-width: 768px) {
+                .main-content {
                     grid-template-columns: 1fr;
-                }}
+                }
                 
-                .header h1 {{
+                .header h1 {
                     font-size: 2.2rem;
-                }}
+                }
                 
-                .message-bubble {{
+                .message-bubble {
                     max-width: 90%; /* Allow bubbles to take more space on small screens */
-                }}
+                }
                 
-                .sidebar {{
+                .sidebar {
                     order: 2; /* Put sidebar below chat on mobile */
-                }}
-                .chat-section {{
+                }
+                .chat-section {
                     order: 1;
-                }}
-            }}
+                }
+            }
 
             /* For even smaller screens (e.g., narrow phones) */
-            @media (max-width: 480px) {{
-                .container {{
+            @media (max-width: 480px) {
+                .container {
                     padding: 10px;
-                }}
-                .header h1 {{
+                }
+                .header h1 {
                     font-size: 1.8rem;
-                }}
-                .header p {{
+                }
+                .header p {
                     font-size: 1rem;
-                }}
-                .chat-section, .stats-card {{
+                }
+                .chat-section, .stats-card {
                     padding: 15px;
-                }}
-                .sorry-counter {{
+                }
+                .sorry-counter {
                     padding: 18px;
-                }}
-                .sorry-counter .number {{
+                }
+                .sorry-counter .number {
                     font-size: 2.8rem;
-                }}
-                .refresh-btn {{
+                }
+                .refresh-btn {
                     padding: 10px 20px;
                     font-size: 0.95rem;
-                }}
-            }}
-        </style>
+                }
+            }
+        """
+
+# Viewer page with @@name@@ slots, filled by render_template
+VIEWER_TEMPLATE = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Our Beautiful Conversations </title>
+        @@style@@
     </head>
     <body>
         <div class="container">
             <div class="header">
                 <h1>Our Beautiful Conversations </h1>
-                <p>A collection of our cherished moments, always fresh and full of love. Built with ❤️ by Aaditya for Shloka.</p>
+                <p>A collection of our cherished moments, always fresh and full of love. Built with ❤️ by @@your_name@@ for @@her_name@@.</p>
             </div>
             
             <div class="main-content">
@@ -574,22 +2462,22 @@ def generate_clean_html(messages, analytics):
                     <div class="stats-card">
                         <h3>Sorry Counter 😅</h3>
                         <div class="sorry-counter">
-                            <span class="number">{analytics['sorry_count']}</span>
-                            <div class="label">Times Aaditya said sorry</div>
+                            <span class="number">@@sorry_count@@</span>
+                            <div class="label">Times @@your_name@@ said sorry</div>
                         </div>
                     </div>
                     
                     <div class="stats-card">
                         <h3>Your Most Used Words 💬</h3>
                         <div class="word-list">
-                            {chr(10).join([f'<div class="word-item you"><span>{word}</span><span class="word-count">{count}</span></div>' for word, count in analytics['your_top_words'][:6]])}
+                            @@your_words@@
                         </div>
                     </div>
                     
                     <div class="stats-card">
-                        <h3>Shloka's Most Used Words 🌸</h3>
+                        <h3>@@her_name@@'s Most Used Words 🌸</h3>
                         <div class="word-list">
-                            {chr(10).join([f'<div class="word-item her"><span>{word}</span><span class="word-count">{count}</span></div>' for word, count in analytics['her_top_words'][:6]])}
+                            @@her_words@@
                         </div>
                     </div>
                     
@@ -597,15 +2485,22 @@ def generate_clean_html(messages, analytics):
                         <h3>Sweet Words Shared 🥰</h3>
                         <div class="simple-stats">
                             <div class="simple-stat">
-                                <div class="number">{analytics['your_love_count']}</div>
+                                <div class="number">@@your_love_count@@</div>
                                 <div class="label">From You</div>
                             </div>
                             <div class="simple-stat">
-                                <div class="number">{analytics['her_love_count']}</div>
+                                <div class="number">@@her_love_count@@</div>
                                 <div class="label">From Her</div>
                             </div>
                         </div>
                     </div>
+                    
+                    <div class="stats-card" id="activityCard" hidden>
+                        <h3>When We Talk ⏰</h3>
+                        <div class="heatmap" id="activityHeatmap"></div>
+                        <div class="activity-note" id="busiestDay"></div>
+                        <div class="word-list" id="replyTimes"></div>
+                    </div>
                 </div>
                 
                 <div class="chat-section">
@@ -613,6 +2508,8 @@ def generate_clean_html(messages, analytics):
                         <button class="refresh-btn" onclick="loadNewConversations()">
                              Load Fresh Conversations
                         </button>
+                        <input id="searchBox" class="search-box" type="search" placeholder="Search our conversations... 🔍" hidden>
+                        <div id="searchStatus" class="search-status"></div>
                     </div>
                     <div id="conversationsContainer">
                         <div class="loading">Loading our story... </div>
@@ -622,93 +2519,447 @@ def generate_clean_html(messages, analytics):
         </div>
         
         <script>
-            const allConversations = {conversations_json};
+            // Either every conversation inline, or the manifest of monthly chunk files
+            const conversationPayload = @@conversations@@;
+            const conversationChunks = @@chunks@@;
+            // The search index inline, {url} of its file next to the chunks, or null
+            const searchPayload = @@search_index@@;
+            const yourName = @@your_name_json@@;
+            const dateOrder = @@date_order@@;
+            const chunkRequests = new Map();
+            
+            // Inflate a {"gzip": "<base64>"} payload; plain ones pass through
+            function decodePayload(payload) {
+                if (!payload.gzip) return Promise.resolve(payload);
+                const bytes = Uint8Array.from(atob(payload.gzip), c => c.charCodeAt(0));
+                const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+                return new Response(stream).json();
+            }
+            
+            const inlineConversations = conversationPayload ? decodePayload(conversationPayload) : null;
+            const conversationCount = inlineConversations
+                ? inlineConversations.then(payload => payload.conversations.length)
+                : Promise.resolve(conversationChunks.reduce((total, chunk) => total + chunk.count, 0));
+            
+            // Rebuild the messages of a [start minute, sender ids, minute offsets, texts] conversation
+            function unpackConversation(payload, index) {
+                const [start, senderIds, minutes, texts] = payload.conversations[index];
+                const pad = number => String(number).padStart(2, '0');
+                return texts.map((message, i) => {
+                    const at = new Date((start + minutes[i]) * 60000);
+                    const [day, month] = [pad(at.getUTCDate()), pad(at.getUTCMonth() + 1)];
+                    return {
+                        date: `${dateOrder === 'mdy' ? `${month}/${day}` : `${day}/${month}`}/${pad(at.getUTCFullYear() % 100)}`,
+                        time: `${pad(at.getUTCHours())}:${pad(at.getUTCMinutes())}`,
+                        sender: payload.senders[senderIds[i]],
+                        message
+                    };
+                });
+            }
             
-            function loadNewConversations() {{
+            function fetchPayload(url) {
+                return fetch(url).then(response => {
+                    if (!response.ok) throw new Error(`${url}: ${response.status}`);
+                    return response.json();
+                }).then(decodePayload);
+            }
+            
+            function fetchChunk(chunk) {
+                if (!chunkRequests.has(chunk.url)) {
+                    chunkRequests.set(chunk.url, fetchPayload(chunk.url));
+                }
+                return chunkRequests.get(chunk.url);
+            }
+            
+            function chunkFor(index) {
+                let low = 0, high = conversationChunks.length - 1;
+                while (low < high) {
+                    const middle = (low + high + 1) >> 1;
+                    if (conversationChunks[middle].start <= index) low = middle;
+                    else high = middle - 1;
+                }
+                return conversationChunks[low];
+            }
+            
+            function getConversations(indices) {
+                if (inlineConversations) {
+                    return inlineConversations.then(payload => indices.map(index => unpackConversation(payload, index)));
+                }
+                return Promise.all(indices.map(index => {
+                    const chunk = chunkFor(index);
+                    return fetchChunk(chunk).then(payload => unpackConversation(payload, index - chunk.start));
+                }));
+            }
+            
+            // Uniform sample of k distinct indices below n in O(k): a partial
+            // Fisher-Yates shuffle that only remembers the swapped slots
+            function sampleIndices(n, k) {
+                const swapped = new Map();
+                const picked = [];
+                for (let i = 0; i < Math.min(k, n); i++) {
+                    const j = i + Math.floor(Math.random() * (n - i));
+                    picked.push(swapped.has(j) ? swapped.get(j) : j);
+                    swapped.set(j, swapped.has(i) ? swapped.get(i) : i);
+                }
+                return picked;
+            }
+            
+            // Search: binary search the sorted terms, intersect their id lists
+            let searchIndex = null;
+            const searchIds = new Map();
+            const wordPattern = /(?<![\\p{L}\\p{N}_])[a-z]{3,}(?![\\p{L}\\p{N}_])/gu;
+            const maxSearchResults = 6;
+            let viewGeneration = 0; // Bumped per search or refresh, so stale results are dropped
+            
+            function termIds(index, position) {
+                if (!searchIds.has(position)) {
+                    let id = 0;
+                    searchIds.set(position, index.ids[position].map(delta => id += delta));
+                }
+                return searchIds.get(position);
+            }
+            
+            function lowerBound(terms, word) {
+                let low = 0, high = terms.length;
+                while (low < high) {
+                    const middle = (low + high) >> 1;
+                    if (terms[middle] < word) low = middle + 1;
+                    else high = middle;
+                }
+                return low;
+            }
+            
+            // Ids for a whole word, or for every word starting with it
+            function wordIds(index, word, prefix) {
+                let position = lowerBound(index.terms, word);
+                if (!prefix) {
+                    return index.terms[position] === word ? termIds(index, position) : [];
+                }
+                const ids = new Set();
+                for (let seen = 0; position < index.terms.length && index.terms[position].startsWith(word) && seen < 100; position++, seen++) {
+                    termIds(index, position).forEach(id => ids.add(id));
+                }
+                return [...ids].sort((a, b) => a - b);
+            }
+            
+            function intersect(a, b) {
+                const result = [];
+                for (let i = 0, j = 0; i < a.length && j < b.length;) {
+                    if (a[i] < b[j]) i++;
+                    else if (a[i] > b[j]) j++;
+                    else { result.push(a[i]); i++; j++; }
+                }
+                return result;
+            }
+            
+            // A separate index file is only fetched once the search box is used
+            function loadSearchIndex() {
+                if (!searchIndex) {
+                    searchIndex = searchPayload.url ? fetchPayload(searchPayload.url) : decodePayload(searchPayload);
+                }
+                return searchIndex;
+            }
+            
+            function searchConversations(query) {
+                const generation = ++viewGeneration;
+                const container = document.getElementById('conversationsContainer');
+                const status = document.getElementById('searchStatus');
+                const words = query.toLowerCase().match(wordPattern) || [];
+                if (!words.length) {
+                    status.textContent = '';
+                    if (!query.trim()) loadNewConversations();
+                    return;
+                }
+                
+                // The word being typed also matches longer words
+                const typing = !/\\s$/.test(query) && query.toLowerCase().endsWith(words[words.length - 1]);
+                loadSearchIndex().then(index => {
+                    const ids = words
+                        .map((word, i) => wordIds(index, word, typing && i === words.length - 1))
+                        .sort((a, b) => a.length - b.length)
+                        .reduce(intersect);
+                    status.textContent = `${ids.length} conversation${ids.length === 1 ? '' : 's'} found`;
+                    return getConversations(ids.slice(0, maxSearchResults));
+                }).then(conversations => {
+                    if (generation === viewGeneration) renderConversations(container, conversations);
+                }).catch(error => console.error(error));
+            }
+            
+            @@render_script@@
+            function loadNewConversations() {
                 const container = document.getElementById('conversationsContainer');
                 container.innerHTML = '<div class="loading">Loading fresh conversations... 💕</div>';
                 
-                // Shuffle conversations and pick a few
-                const shuffled = [...allConversations].sort(() => 0.5 - Math.random());
-                const selectedConversations = shuffled.slice(0, Math.min(4, shuffled.length));
+                // Pick a few conversations at random
+                const generation = ++viewGeneration;
+                conversationCount.then(total => getConversations(sampleIndices(total, 4))).then(selectedConversations => setTimeout(() => {
+                    if (generation === viewGeneration) renderConversations(container, selectedConversations);
+                }, 600)).catch(error => { // Initial delay for "Loading fresh conversations..."
+                    container.innerHTML = '<div class="loading">Could not load conversations 😢</div>';
+                    console.error(error);
+                });
+            }
+            
+            // Activity card: hour-of-week heatmap, busiest day and typical reply times
+            const activity = @@activity@@;
+            
+            function drawActivity() {
+                const heatmap = document.getElementById('activityHeatmap');
+                const fragment = document.createDocumentFragment();
+                const busiest = Math.max(1, ...activity.hour_of_week);
+                const weekdays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'];
+                
+                weekdays.forEach((weekday, day) => {
+                    const label = document.createElement('div');
+                    label.textContent = weekday;
+                    fragment.appendChild(label);
+                    for (let hour = 0; hour < 24; hour++) {
+                        const count = activity.hour_of_week[day * 24 + hour];
+                        const cell = document.createElement('div');
+                        cell.className = 'heatmap-cell';
+                        cell.style.opacity = 0.08 + 0.92 * count / busiest;
+                        cell.title = `${weekday} ${String(hour).padStart(2, '0')}:00 • ${count} messages`;
+                        fragment.appendChild(cell);
+                    }
+                });
+                heatmap.appendChild(fragment);
                 
-                setTimeout(() => {{
-                    container.innerHTML = ''; // Clear loading message
-                    
-                    selectedConversations.forEach((conversation, convIndex) => {{
-                        const conversationDiv = document.createElement('div');
-                        conversationDiv.className = 'conversation';
-                        
-                        const firstMsg = conversation[0];
-                        conversationDiv.innerHTML = `
-                            <div class="conversation-header">
-                                <div class="conversation-date">${{firstMsg.date}} • ${{conversation.length}} messages</div>
-                            </div>
-                        `;
-                        
-                        // Use a promise or callback chain for sequential message display
-                        let messageDelay = 0;
-                        conversation.forEach((msg, msgIndex) => {{
-                            messageDelay += 100; // Small delay between messages
-                            setTimeout(() => {{
-                                const messageDiv = document.createElement('div');
-                                messageDiv.className = `message ${{msg.sender === 'Aaditya' ? 'you' : 'her'}}`;
-                                
-                                messageDiv.innerHTML = `
-                                    <div class="message-bubble">
-                                        ${{msg.message}}
-                                    </div>
-                                    <div class="message-time">${{msg.time}}</div>
-                                `;
-                                
-                                conversationDiv.appendChild(messageDiv);
-                                setTimeout(() => messageDiv.classList.add('show'), 10); // Add show class for animation
-                            }}, messageDelay);
-                        }});
-                        
-                        // Append the whole conversation after its messages are scheduled
-                        setTimeout(() => {{
-                            container.appendChild(conversationDiv);
-                        }}, messageDelay + 200); // Small extra delay before adding next conversation
-                    }});
-                }}, 600); // Initial delay for "Loading fresh conversations..."
-            }}
+                if (activity.days.length) {
+                    const top = activity.days.indexOf(Math.max(...activity.days));
+                    const date = new Date(Date.parse(activity.first_day) + top * 86400000);
+                    document.getElementById('busiestDay').textContent =
+                        `Busiest day: ${date.toLocaleDateString(undefined, { timeZone: 'UTC' })} • ${activity.days[top]} messages`;
+                }
+                
+                // The most common reply time bucket of each sender
+                const replies = document.getElementById('replyTimes');
+                Object.entries(activity.latency).forEach(([sender, buckets]) => {
+                    const item = document.createElement('div');
+                    item.className = `word-item ${sender === yourName ? 'you' : 'her'}`;
+                    const name = document.createElement('span');
+                    name.textContent = `${sender} usually replies in`;
+                    const typical = document.createElement('span');
+                    typical.className = 'word-count';
+                    typical.textContent = activity.latency_buckets[buckets.indexOf(Math.max(...buckets))];
+                    item.append(name, typical);
+                    replies.appendChild(item);
+                });
+                
+                document.getElementById('activityCard').hidden = false;
+            }
             
             // Initialize on page load
-            document.addEventListener('DOMContentLoaded', function() {{
+            document.addEventListener('DOMContentLoaded', function() {
+                if (activity) drawActivity();
+                if (searchPayload) {
+                    const searchBox = document.getElementById('searchBox');
+                    searchBox.hidden = false;
+                    searchBox.addEventListener('input', () => searchConversations(searchBox.value));
+                }
                 loadNewConversations();
-            }});
+            });
         </script>
     </body>
     </html>
     """
+
+_template_segments = {}
+_minified_css = {}
+
+
+SEARCH_INDEX_FILE = "search-index.json"
+
+def write_search_index_file(search_index, chunk_dir, chunk_url=None, compress=False):
+    """Write a ConversationSearchIndex to chunk_dir and return the URL the page fetches it by
     
-    return html_content
+    Like the conversation chunks, the index then adds nothing to the page
+    itself; the page only fetches it when the search box is first used.
+    """
+    with open(os.path.join(chunk_dir, SEARCH_INDEX_FILE), 'w', encoding='utf-8') as file:
+        search_index.write(file, compress)
+    return _chunk_file_url(chunk_dir, chunk_url, SEARCH_INDEX_FILE)
 
-# Main execution
-if __name__ == "__main__":
-    chat_file = "chat.txt"
+def compile_template(template):
+    """Split a template into (text, slot) pairs once, the last slot being None"""
+    if template not in _template_segments:
+        parts = re.split(r'@@(\w+)@@', template)
+        _template_segments[template] = list(zip(parts[::2], parts[1::2] + [None]))
+    return _template_segments[template]
+
+def render_template(fp, template, slots):
+    """Write a template to fp with its slots filled in
+    
+    A slot value is either a string or a callable that writes the slot
+    content to fp itself.
+    """
+    for text, slot in compile_template(template):
+        fp.write(text)
+        if slot is not None:
+            value = slots[slot]
+            if callable(value):
+                value(fp)
+            else:
+                fp.write(value)
+
+def minify_css(css):
+    """Drop comments and layout whitespace from a stylesheet"""
+    if css not in _minified_css:
+        minified = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+        minified = re.sub(r'\s+', ' ', minified)
+        minified = re.sub(r' ?([{};,>]) ?', r'\1', minified)
+        _minified_css[css] = minified.replace(': ', ':').replace(';}', '}').strip()
+    return _minified_css[css]
+
+def write_viewer_css(path, minify=True):
+    """Write the viewer stylesheet for pages generated with css_href"""
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(minify_css(VIEWER_CSS) if minify else VIEWER_CSS)
+
+def _word_items(top_words, side):
+    return '\n'.join(f'<div class="word-item {side}"><span>{word}</span><span class="word-count">{count}</span></div>'
+                     for word, count in top_words[:6])
+
+def generate_clean_html(messages, analytics, conversations=None, chunk_dir=None, renderer='batched',
+                        minify=False, css_href=None, compress=False, search=False, activity=None):
+    """Generate clean and simple HTML for your girlfriend, see write_clean_html"""
+    output = io.StringIO()
+    write_clean_html(output, messages, analytics, conversations, chunk_dir, renderer, minify, css_href, compress,
+                     search, activity)
+    return output.getvalue()
+
+def write_clean_html(fp, messages, analytics, conversations=None, chunk_dir=None, renderer='batched',
+                     minify=False, css_href=None, compress=False, search=False, activity=None):
+    """Write clean and simple HTML for your girlfriend to a text file object.
+    
+    The page is streamed: the conversations are encoded one at a time straight
+    into fp, so memory does not grow with the size of the chat.
+    
+    Conversations are extracted from messages unless already given. They are
+    inlined into the page, or with chunk_dir written there as per-month JSON
+    files that the page fetches only when it shows one of their
+    conversations (the page then has to be served over HTTP). Either way
+    they are written by write_conversation_payload, gzipped if compress is
+    set.
     
-    print("🔄 Creating clean and simple conversation viewer...")
+    renderer picks the script that draws them, see VIEWER_RENDERERS: the
+    default 'batched' one, or the original per-message 'timers' one.
     
-    # Parse the chat
-    messages = parse_whatsapp_chat(chat_file)
+    With search, the page gets a search box backed by a ConversationSearchIndex
+    over all conversations. The index is built in memory and grows with the
+    chat, which is why search is off by default. With chunk_dir it is written
+    there as SEARCH_INDEX_FILE and fetched on the first search, otherwise it
+    is embedded in the page.
     
-    if messages:
-        print(f"✅ Found {len(messages)} valid messages!")
+    activity is the aggregate_activity payload drawn as a heatmap card. It
+    defaults to analytics['activity'] or else is computed from messages.
+    
+    Dates are shown in the export's day/month order: analytics['date_order']
+    if there is one, else that of the MessageStore, else day first.
+    
+    The page is filled into the precompiled VIEWER_TEMPLATE. Its stylesheet
+    is inlined, minified if asked, or linked from css_href for pages that
+    share one file written by write_viewer_css.
+    """
+    
+    if renderer not in VIEWER_RENDERERS:
+        raise ValueError(f"Unknown renderer {renderer!r}, expected one of {sorted(VIEWER_RENDERERS)}")
+    render_script = VIEWER_RENDERERS[renderer]
+    
+    if conversations is None:
+        if not messages:
+            fp.write("<html><body><h1>No messages found!</h1></body></html>")
+            return
         
-        # Analyze chat data
-        analytics = analyze_chat_data(messages)
+        conversations = extract_conversations(messages, min_length=4, max_length=12)
+    
+    if activity is None:
+        activity = analytics.get('activity')
+    if activity is None and messages:
+        activity = aggregate_activity(messages)
+    
+    search_index = ConversationSearchIndex() if search else None
+    search_slot = (lambda out: search_index.write(out, compress)) if search else 'null'
+    if chunk_dir is None:
+        chunks_json = 'null'
+    else:
+        # Chunks hold whole months, so order the conversations by month first
+        conversations = sorted(conversations, key=lambda conv: conv[0]['ts'])
+        chunks_json = json.dumps(write_conversation_chunks(conversations, chunk_dir, compress=compress,
+                                                           search_index=search_index))
+        if search:
+            search_slot = json.dumps({'url': write_search_index_file(search_index, chunk_dir, compress=compress)})
+    
+    if css_href is not None:
+        style = f'<link rel="stylesheet" href="{css_href}">'
+    else:
+        style = f"<style>{minify_css(VIEWER_CSS) if minify else VIEWER_CSS}</style>"
+    
+    if chunk_dir is None:
+        conversations_slot = lambda out: write_conversation_payload(out, conversations, compress, search_index)
+    else:
+        conversations_slot = 'null'
+    
+    you, her = (name or '' for name in analytics.get('participants', PARTICIPANTS))
+    date_order = analytics.get('date_order') or getattr(messages, 'date_order', 'dmy')
+    
+    render_template(fp, VIEWER_TEMPLATE, {
+        'style': style,
+        'your_name': html.escape(you),
+        'her_name': html.escape(her),
+        'your_name_json': json.dumps(you).replace('</', '<\\/'),
+        'date_order': json.dumps(date_order),
+        'activity': json.dumps(activity).replace('</', '<\\/'),
+        'sorry_count': str(analytics['sorry_count']),
+        'your_words': _word_items(analytics['your_top_words'], 'you'),
+        'her_words': _word_items(analytics['her_top_words'], 'her'),
+        'your_love_count': str(analytics['your_love_count']),
+        'her_love_count': str(analytics['her_love_count']),
+        'chunks': chunks_json,
+        'render_script': render_script,
+        'conversations': conversations_slot,
+        # Filled while the conversations are written, so it has to come after them
+        'search_index': search_slot,
+    })
+
+# Main execution
+def build_storybook(chat_file, output_file, snapshot_file, metrics=None, participants=PARTICIPANTS, index_file=None,
+                    search=False):
+    """Run the whole pipeline on one export and write its viewer
+    
+    With search the viewer gets a search box, see write_clean_html. With
+    index_file a search index of the messages is kept there as well, see
+    update_message_index. Returns the number of messages found; nothing is
+    written without any.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    
+    # Parse and analyze the chat, picking up where the last run stopped
+    try:
+        analytics, conversations = analyze_chat_incremental(chat_file, snapshot_file, participants=participants,
+                                                            metrics=metrics)
+        message_count = sum(stats['message_count'] for stats in analytics['senders'].values())
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile) as e:
+        metrics.count('errors')
+        metrics.sample('errors', f"{type(e).__name__}: {e}")
+        print(f"❌ Error: {e}")
+        message_count = 0
+    
+    if message_count:
+        print(f"✅ Found {message_count} valid messages!")
         
-        # Generate clean HTML
-        html_output = generate_clean_html(messages, analytics)
+        # Generate clean HTML straight into the file
+        with metrics.stage('html'):
+            with open(output_file, "w", encoding="utf-8") as f:
+                write_clean_html(f, None, analytics, conversations, search=search)
+        metrics.count('bytes_emitted', os.path.getsize(output_file))
         
-        # Save to file
-        with open("clean_conversations.html", "w", encoding="utf-8") as f:
-            f.write(html_output)
+        if index_file is not None:
+            with metrics.stage('index'):
+                update_message_index(chat_file, index_file, participants, metrics)
         
         print("✨ Clean conversation viewer created!")
-        print("📁 File: clean_conversations.html")
+        print(f"📁 File: {output_file}")
         print("🎁 Features:")
         print("   - Simple, clean UI design")
         print("   - No milestone tracking")
@@ -718,4 +2969,243 @@ if __name__ == "__main__":
         print("   - Two-column layout")
         
     else:
-        print("❌ No messages parsed. Check your chat.txt file.")
+        print(f"❌ No messages parsed. Check your {chat_file} file.")
+    
+    return message_count
+
+# Batch mode: many exports rendered into one directory
+CHAT_EXTENSIONS = ('.txt', '.zip', '.gz')
+BATCH_MANIFEST = "manifest.json"
+
+def expand_inputs(patterns, exclude=None):
+    """Exports named by paths, glob patterns or directories, in order and without repeats
+    
+    Directories are searched recursively for files with CHAT_EXTENSIONS,
+    skipping the directory exclude, where earlier outputs live. Plain paths
+    are kept even if they do not exist, so they fail visibly.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                paths += [os.path.join(root, name) for name in sorted(files) if name.endswith(CHAT_EXTENSIONS)]
+        elif any(c in pattern for c in '*?['):
+            paths += sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+        else:
+            paths.append(pattern)
+    
+    seen = set()
+    unique = []
+    exclude = exclude and os.path.abspath(exclude)
+    for path in paths:
+        key = os.path.abspath(path)
+        if exclude and os.path.commonpath([key, exclude]) == exclude:
+            continue
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+def batch_names(paths):
+    """A distinct output name per export; exports are often all called chat.txt"""
+    stems = [os.path.basename(path) for path in paths]
+    stems = [os.path.splitext(stem[:-3] if stem.endswith('.gz') else stem)[0].lstrip('_') or 'chat' for stem in stems]
+    counts = Counter(stems)
+    names = []
+    for path, stem in zip(paths, stems):
+        if counts[stem] > 1:
+            full_path = os.path.abspath(path)
+            parent = os.path.basename(os.path.dirname(full_path))
+            stem = f"{parent}-{stem}-{hashlib.sha256(full_path.encode('utf-8')).hexdigest()[:8]}"
+        names.append(stem)
+    return names
+
+def _file_hash(file_path):
+    # Hashing the mapped file spares copying it through read buffers
+    with open(file_path, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return hashlib.sha256().hexdigest()
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+def _build_job(chat_file, output_file, snapshot_file, participants, known_hash):
+    start = perf_counter()
+    metrics = PipelineMetrics()
+    result = {'input': chat_file, 'output': output_file, 'hash': None, 'messages': 0, 'metrics': metrics}
+    try:
+        result['hash'] = _file_hash(chat_file)
+        if result['hash'] == known_hash and os.path.exists(output_file):
+            result['status'] = 'unchanged'
+        else:
+            # Workers run side by side, their chatter would only interleave
+            with redirect_stdout(io.StringIO()):
+                result['messages'] = build_storybook(chat_file, output_file, snapshot_file, metrics, participants)
+            result['status'] = 'built' if result['messages'] else 'failed'
+            if not result['messages']:
+                result['error'] = metrics.samples.get('errors', ["no messages parsed"])[0]
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = perf_counter() - start
+    return result
+
+def load_batch_manifest(manifest_path):
+    try:
+        with open(manifest_path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_batch_manifest(manifest_path, manifest):
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    os.replace(temp_path, manifest_path)
+
+def run_batch(paths, output_dir, workers=None, participants=PARTICIPANTS, metrics=None, force=False):
+    """Render a viewer for every export into output_dir, several at a time
+    
+    Each export is built by build_storybook in its own worker process, at
+    most `workers` at once, with its snapshot next to its viewer. The
+    manifest in output_dir keeps each input's content hash, so exports that
+    have not changed since they were last built are skipped unless force is
+    set. Progress is printed as exports finish, and their metrics are added
+    to metrics if given.
+    
+    Returns one result dict per export, in completion order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, BATCH_MANIFEST)
+    config = {'version': SNAPSHOT_VERSION, 'parser_version': PARSER_VERSION,
+              'participants': None if participants is None else list(participants)}
+    manifest = load_batch_manifest(manifest_path)
+    if manifest.get('config') != config:
+        manifest = {'config': config, 'files': {}}
+    
+    jobs = []
+    for path, name in zip(paths, batch_names(paths)):
+        output_file = os.path.join(output_dir, f"{name}.html")
+        entry = manifest['files'].get(os.path.abspath(path), {})
+        known_hash = entry.get('hash') if not force and entry.get('output') == output_file else None
+        jobs.append((path, output_file, os.path.join(output_dir, f"{name}.snapshot.json.gz"), participants, known_hash))
+    
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    print(f"📚 Building {len(jobs)} viewers into {output_dir} with {workers} worker(s)...")
+    
+    start = perf_counter()
+    results = []
+    width = len(str(len(jobs)))
+    
+    def finished(result):
+        results.append(result)
+        if metrics is not None:
+            metrics.merge(result['metrics'])
+        del result['metrics']
+        
+        if result['status'] == 'built':
+            manifest['files'][os.path.abspath(result['input'])] = {
+                'hash': result['hash'], 'output': result['output'], 'messages': result['messages']}
+            save_batch_manifest(manifest_path, manifest)
+            detail = f"✅ {result['messages']} messages in {result['seconds']:.1f}s"
+        elif result['status'] == 'unchanged':
+            detail = "⏭️ unchanged"
+        else:
+            detail = f"❌ {result['error']}"
+        
+        elapsed = perf_counter() - start
+        print(f"[{len(results):>{width}}/{len(jobs)}] {result['input']}: {detail} ({elapsed:.1f}s elapsed)")
+    
+    if workers == 1:
+        for job in jobs:
+            finished(_build_job(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for future in as_completed([pool.submit(_build_job, *job) for job in jobs]):
+                finished(future.result())
+    
+    elapsed = perf_counter() - start
+    statuses = Counter(result['status'] for result in results)
+    messages = sum(result['messages'] for result in results)
+    print(f"🏁 {len(results)} exports in {elapsed:.1f}s: {statuses['built']} built, "
+          f"{statuses['unchanged']} unchanged, {statuses['failed']} failed, {messages} messages")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Turn WhatsApp exports into clean conversation viewers")
+    parser.add_argument('inputs', nargs='*', default=["chat.txt"],
+                        help="exports (.txt, .zip or .gz), glob patterns or directories; "
+                             "more than one switches to batch mode")
+    parser.add_argument('--output', default="clean_conversations.html", help="viewer of a single export")
+    parser.add_argument('--snapshot', default="chat_snapshot.json.gz", help="checkpoint of a single export")
+    parser.add_argument('--index', help="also keep a search index of a single export's messages here")
+    parser.add_argument('--search', action='store_true',
+                        help="give a single export's viewer a search box; its index is embedded in the page")
+    parser.add_argument('--output-dir', help="build every input into this directory (batch mode)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="exports built at once in batch mode")
+    parser.add_argument('--force', action='store_true', help="rebuild batch inputs even if unchanged")
+    parser.add_argument('--participants', default=','.join(PARTICIPANTS),
+                        help="comma separated senders to keep, or 'all' to keep everyone")
+    parser.add_argument('--metrics', help="write stage timings and parse counters as JSON")
+    parser.add_argument('--profile', nargs='?', const="chat_storybook_profile", metavar='PREFIX',
+                        help="run under cProfile and tracemalloc, writing PREFIX.pstats, "
+                             "PREFIX.memory.txt and PREFIX.metrics.json; in batch mode only with --workers 1")
+    args = parser.parse_args(argv)
+    
+    participants = None if args.participants == 'all' else tuple(
+        name.strip() for name in args.participants.split(',') if name.strip())
+    output_dir = args.output_dir or "storybooks"
+    paths = expand_inputs(args.inputs, exclude=output_dir)
+    if not paths:
+        print(f"❌ No chat exports found in {' '.join(args.inputs)}")
+        return 1
+    batch = args.output_dir is not None or len(paths) != 1
+    
+    if batch:
+        print("🔄 Creating clean and simple conversation viewers...")
+    else:
+        print("🔄 Creating clean and simple conversation viewer...")
+    
+    metrics = PipelineMetrics()
+    report_path = args.metrics
+    if args.profile:
+        report_path = report_path or f"{args.profile}.metrics.json"
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    with metrics.stage('total'):
+        if batch:
+            results = run_batch(paths, output_dir, args.workers, participants, metrics, args.force)
+            failed = sum(result['status'] == 'failed' for result in results)
+        else:
+            failed = not build_storybook(paths[0], args.output, args.snapshot, metrics, participants, args.index,
+                                         args.search)
+    report = metrics.report()
+    if batch:
+        report['files'] = results
+    
+    if args.profile:
+        profiler.disable()
+        memory = tracemalloc.take_snapshot()
+        report['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        
+        profiler.dump_stats(f"{args.profile}.pstats")
+        with open(f"{args.profile}.memory.txt", "w", encoding="utf-8") as f:
+            f.write(f"Peak traced memory: {report['peak_memory_bytes']:,} bytes\n\n")
+            for stat in memory.statistics('lineno')[:25]:
+                f.write(f"{stat}\n")
+        print(f"🔬 Profile: {args.profile}.pstats, {args.profile}.memory.txt")
+    
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📈 Metrics: {report_path}")
+    
+    print("⏱️ Pipeline metrics:")
+    print(metrics.summary())
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.fixture
+def write_export(tmp_path):
+    """Write export text to a file in tmp_path and return its path"""
+    def write(text, name='chat.txt'):
+        path = tmp_path / name
+        path.write_text(text, encoding='utf-8')
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def columns():
+    """Compare MessageStores by their raw columns"""
+    def columns(store):
+        return list(store.timestamps), list(store.sender_ids), list(store.offsets), bytes(store.text), store.senders
+    return columns
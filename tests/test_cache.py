@@ -0,0 +1,81 @@
+import json
+import os
+
+import chat_storybook as storybook
+
+
+def export_text():
+    return "".join(f"[08/09/20, 1:{n:02d}:00 PM] {storybook.PARTICIPANTS[n % 2]}: message {n} 😘\n" for n in range(40))
+
+
+def test_cache_round_trip_and_invalidation(write_export, tmp_path, columns):
+    path = write_export(export_text())
+    cache = str(tmp_path / 'chat.cache')
+    parsed = storybook.parse_whatsapp_chat(path, cache_path=cache)
+    
+    metrics = storybook.PipelineMetrics()
+    cached = storybook.parse_whatsapp_chat(path, cache_path=cache, metrics=metrics)
+    assert metrics.counters['cache_hits'] == 1
+    assert columns(cached) == columns(parsed)
+    assert [row['message'] for row in cached] == [row['message'] for row in parsed]
+    
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write("[08/09/20, 2:00:00 PM] Shloka: one more\n")
+    metrics = storybook.PipelineMetrics()
+    assert len(storybook.parse_whatsapp_chat(path, cache_path=cache, metrics=metrics)) == 41
+    assert 'cache_hits' not in metrics.counters
+
+
+def test_unwritable_cache_keeps_the_parse(write_export, tmp_path):
+    path = write_export(export_text())
+    metrics = storybook.PipelineMetrics()
+    messages = storybook.parse_whatsapp_chat(path, cache_path=str(tmp_path / 'missing' / 'chat.cache'),
+                                             metrics=metrics)
+    assert len(messages) == 40
+    assert metrics.counters['cache_write_errors'] == 1
+    assert 'errors' not in metrics.counters
+
+
+def test_damaged_cache_is_a_miss(write_export, tmp_path):
+    path = write_export(export_text())
+    cache = str(tmp_path / 'chat.cache')
+    storybook.parse_whatsapp_chat(path, cache_path=cache)
+    
+    # Keep the key but break the column sizes
+    with open(cache, 'rb') as file:
+        data = file.read()
+    start = len(storybook.MESSAGE_CACHE_MAGIC) + 8
+    size = int.from_bytes(data[len(storybook.MESSAGE_CACHE_MAGIC):start], 'little')
+    header = json.loads(data[start:start + size])
+    header['sections'][0] -= 3
+    damaged = json.dumps(header).encode('utf-8').ljust(size)
+    with open(cache, 'wb') as file:
+        file.write(data[:start] + damaged + data[start + size:])
+    
+    key = storybook.message_cache_key(path)
+    assert storybook.load_message_cache(cache, key) is None
+    assert len(storybook.parse_whatsapp_chat(path, cache_path=cache)) == 40
+    assert storybook.load_message_cache(cache, key) is not None
+    
+    with open(cache, 'r+b') as file:
+        file.truncate(os.path.getsize(cache) - 16)
+    assert storybook.load_message_cache(cache, key) is None
+
+
+def test_saved_index_is_mapped_and_kept_current(write_export, tmp_path, columns):
+    path = write_export(export_text())
+    index_path = str(tmp_path / 'chat.index')
+    built = storybook.update_message_index(path, index_path)
+    
+    metrics = storybook.PipelineMetrics()
+    loaded = storybook.update_message_index(path, index_path, metrics=metrics)
+    assert metrics.counters['index_hits'] == 1
+    assert isinstance(loaded.postings, memoryview)
+    assert columns(loaded.messages) == columns(built.messages)
+    assert loaded.search('message') == built.search('message') == list(range(40))
+    
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write("[08/09/20, 2:00:00 PM] Shloka: one more message\n")
+    metrics = storybook.PipelineMetrics()
+    assert len(storybook.update_message_index(path, index_path, metrics=metrics).search('message')) == 41
+    assert 'index_hits' not in metrics.counters
@@ -0,0 +1,21 @@
+import chat_storybook as storybook
+
+
+def test_no_matching_inputs_is_an_error(tmp_path, capsys):
+    output_dir = tmp_path / 'out'
+    assert storybook.main([str(tmp_path / 'missing-*.txt'), '--output-dir', str(output_dir)]) == 1
+    assert "No chat exports found" in capsys.readouterr().out
+    assert not output_dir.exists()
+
+
+def test_batch_skips_unchanged_exports(tmp_path, capsys):
+    for name in ('a', 'b'):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'chat.txt').write_text(
+            f"[08/09/20, 1:32:37 PM] Aaditya: hi {name}\n[08/09/20, 1:33:00 PM] Shloka: hey\n", encoding='utf-8')
+    args = [str(tmp_path / '*' / 'chat.txt'), '--output-dir', str(tmp_path / 'out'), '--workers', '1']
+    
+    assert storybook.main(args) == 0
+    assert "2 built" in capsys.readouterr().out
+    assert storybook.main(args) == 0
+    assert "2 unchanged" in capsys.readouterr().out
@@ -0,0 +1,61 @@
+import json
+import random
+
+import pytest
+
+import chat_storybook as storybook
+
+# Both gap finders: NumPy's when it is installed, and the pure Python one
+BACKENDS = [storybook.np, None] if storybook.np is not None else [None]
+
+
+def segmenter_ranges(timestamps, min_length, max_length):
+    segmenter = storybook.ConversationSegmenter(min_length, max_length)
+    segmenter.consume({'ts': ts, 'index': index} for index, ts in enumerate(timestamps))
+    return [(conv[0]['index'], conv[-1]['index'] + 1) for conv in segmenter.results()]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_ranges_match_the_segmenter(backend, monkeypatch):
+    monkeypatch.setattr(storybook, 'np', backend)
+    rng = random.Random(20)
+    gaps = [0, 30, 600, storybook.CONVERSATION_GAP, storybook.CONVERSATION_GAP + 1, 86400]
+    
+    for _ in range(3000):
+        ts = 1600000000
+        timestamps = []
+        for _ in range(rng.randint(0, 60)):
+            ts += rng.choice(gaps)
+            timestamps.append(ts)
+        min_length = rng.randint(1, 8)
+        max_length = rng.randint(1, 16)
+        
+        expected = segmenter_ranges(timestamps, min_length, max_length)
+        assert storybook.conversation_ranges(timestamps, min_length, max_length) == expected
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_gap_statistics(backend, monkeypatch):
+    monkeypatch.setattr(storybook, 'np', backend)
+    stats = storybook.gap_statistics([0, 10, 30, 60, 60 + storybook.CONVERSATION_GAP + 1])
+    
+    assert stats['count'] == 4
+    assert stats['long_gaps'] == 1
+    assert stats['max'] == storybook.CONVERSATION_GAP + 1
+    assert stats['percentiles'][50] == 25
+    assert storybook.gap_statistics([5]) is None
+
+
+def test_chunked_search_index_is_fetched_separately(write_export, tmp_path):
+    path = write_export("".join(f"[{day:02d}/0{month}/20, 1:0{n}:00 PM] {storybook.PARTICIPANTS[n % 2]}: coffee at {n}\n"
+                                for month in (8, 9) for day in (1, 2) for n in range(4)))
+    analytics, conversations = storybook.analyze_chat_incremental(path, str(tmp_path / 'snapshot.json.gz'))
+    
+    chunk_dir = tmp_path / 'chunks'
+    page = storybook.generate_clean_html(None, analytics, conversations, chunk_dir=str(chunk_dir), search=True)
+    assert 'const searchPayload = {"url": "chunks/search-index.json"};' in page
+    index = json.loads((chunk_dir / storybook.SEARCH_INDEX_FILE).read_text(encoding='utf-8'))
+    assert index['terms'] == ['coffee']
+    assert index['ids'] == [[0, 1, 1, 1]]
+    
+    assert 'const searchPayload = null;' in storybook.generate_clean_html(None, analytics, conversations)
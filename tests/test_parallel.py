@@ -0,0 +1,39 @@
+import chat_storybook as storybook
+
+
+def export_text(count):
+    lines = []
+    ts = 1600000000
+    for n in range(count):
+        ts += 45 + n % 13 * 300
+        day = storybook._EPOCH + storybook.timedelta(seconds=ts)
+        hour = day.hour % 12 or 12
+        sender = storybook.PARTICIPANTS[n % 2] if n % 17 else 'Someone Else'
+        lines.append(f"[{day:%d/%m/%y}, {hour}:{day:%M:%S} {'AM' if day.hour < 12 else 'PM'}] "
+                     f"{sender}: sorry love you café {n} 😘\n")
+        if n % 9 == 0:
+            lines.append(f"{day:%d/%m/%Y} is when we met\n")
+    return ''.join(lines)
+
+
+def test_shards_start_at_entries(write_export):
+    path = write_export(export_text(500))
+    ranges = storybook.shard_boundaries(path, 7, 'ios')
+    assert len(ranges) == 7
+    with open(path, 'rb') as file:
+        data = file.read()
+    for start, end in ranges[1:]:
+        assert data[start - 1:start] == b'\n'
+        line = data[start:data.index(b'\n', start)].decode('utf-8')
+        assert storybook.compile_entry_start('ios').match(line)
+
+
+def test_sharded_parse_matches_serial(write_export, monkeypatch, columns):
+    path = write_export(export_text(2000))
+    monkeypatch.setattr(storybook, 'MIN_SHARD_SIZE', 4096)
+    
+    serial = storybook.MessageStore.from_messages(storybook.iter_whatsapp_messages(path))
+    messages, analytics = storybook.parse_chat_parallel(path, workers=3)
+    
+    assert columns(messages) == columns(serial)
+    assert analytics == storybook.analyze_chat_data(serial)
@@ -0,0 +1,100 @@
+import chat_storybook as storybook
+
+
+def messages(path, **kwargs):
+    return [msg['message'] for msg in storybook.iter_whatsapp_messages(path, **kwargs)]
+
+
+def test_continuation_line_starting_with_a_date_stays_in_its_message(write_export):
+    path = write_export(
+        "[08/09/20, 1:32:37 PM] Aaditya: plans:\n"
+        "12/05/2020 is the trip\n"
+        "see you then\n"
+        "[08/09/20, 1:33:00 PM] Shloka: ok\n")
+    assert messages(path) == ["plans:\n12/05/2020 is the trip\nsee you then", "ok"]
+
+
+def test_android_notice_without_sender_still_ends_the_message_above(write_export):
+    path = write_export(
+        "08/09/2020, 13:32 - Aaditya: plans:\n"
+        "12/05/2020 is the trip\n"
+        "08/09/2020, 13:33 - Shloka created group \"trip\"\n"
+        "08/09/2020, 13:34 - Shloka: ok\n")
+    assert messages(path) == ["plans:\n12/05/2020 is the trip", "ok"]
+
+
+def test_continuation_lines_survive_chunk_boundaries(write_export, monkeypatch):
+    monkeypatch.setattr(storybook, 'CHUNK_SIZE', 64)
+    entry = "[08/09/20, 1:32:37 PM] Aaditya: plans:\n12/05/2020 is the trip\nsee you then\n"
+    path = write_export(entry * 20)
+    assert messages(path) == ["plans:\n12/05/2020 is the trip\nsee you then"] * 20
+
+
+def test_message_store_slices_like_a_list(write_export):
+    path = write_export("".join(f"[08/09/20, 1:3{n}:00 PM] Aaditya: message {n}\n" for n in range(5)))
+    store = storybook.parse_whatsapp_chat(path)
+    expected = [f"message {n}" for n in range(5)]
+    assert [row['message'] for row in store[0:3]] == expected[0:3]
+    assert [row['message'] for row in store[::-2]] == expected[::-2]
+    assert store[10:] == []
+    assert store[-1]['message'] == "message 4"
+
+
+def month_first_export(days):
+    """Android lines for January 2021, month first, one message per hour"""
+    return "".join(f"1/{day}/21, {hour:02d}:00 - Shloka: day {day} hour {hour}\n"
+                   for day in days for hour in range(24))
+
+
+def test_date_order_waits_for_a_settling_date(write_export, monkeypatch):
+    # The first chunks only hold days up to 12, which read either way
+    monkeypatch.setattr(storybook, 'CHUNK_SIZE', 256)
+    path = write_export(month_first_export(range(1, 20)))
+    reader = storybook.ChatReader(path)
+    rows = list(reader)
+    
+    assert reader.date_order == 'mdy'
+    assert len(rows) == 19 * 24
+    assert rows[24]['message'] == "day 2 hour 0"
+    assert rows[24]['ts'] == 1609545600  # 2 January 2021
+    assert storybook.sniff_chat_format(path) == ('android', 'mdy')
+
+
+def test_rows_show_dates_in_the_export_order(write_export, tmp_path):
+    path = write_export(month_first_export(range(1, 20)))
+    cache = str(tmp_path / 'chat.cache')
+    parsed = storybook.parse_whatsapp_chat(path, participants=None, cache_path=cache)
+    cached = storybook.parse_whatsapp_chat(path, participants=None, cache_path=cache)
+    
+    assert parsed.date_order == cached.date_order == 'mdy'
+    assert parsed[24]['date'] == cached[24]['date'] == '01/02/21'
+    analytics, conversations = storybook.analyze_chat_incremental(path, str(tmp_path / 'snapshot.json.gz'),
+                                                                  participants=None)
+    assert analytics['date_order'] == 'mdy'
+    page = storybook.generate_clean_html(None, analytics, conversations)
+    assert 'const dateOrder = "mdy";' in page
+
+
+def test_ambiguous_dates_are_read_day_first_but_kept(write_export):
+    path = write_export(month_first_export(range(1, 3)))
+    reader = storybook.ChatReader(path)
+    rows = list(reader)
+    
+    assert len(rows) == 2 * 24
+    assert reader.date_order is None
+    assert rows[24]['ts'] == 1612137600  # 1 February 2021
+    assert storybook.sniff_chat_format(path) == ('android', 'dmy')
+
+
+def test_guessed_date_order_is_not_resumed(write_export, tmp_path):
+    path = write_export(month_first_export(range(1, 3)))
+    snapshot = str(tmp_path / 'snapshot.json.gz')
+    storybook.analyze_chat_incremental(path, snapshot, participants=None)
+    
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(month_first_export(range(13, 15)))
+    analytics, _ = storybook.analyze_chat_incremental(path, snapshot, participants=None)
+    
+    rebuilt, _ = storybook.analyze_chat_incremental(path, str(tmp_path / 'fresh.json.gz'), participants=None)
+    assert analytics == rebuilt
+    assert analytics['activity']['first_day'] == '2021-01-01'